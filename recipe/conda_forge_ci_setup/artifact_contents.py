@@ -0,0 +1,272 @@
+import io
+import json
+import stat
+import tarfile
+import time
+import zipfile
+
+from .digests import BUFFER_SIZE, DEFAULT_ALGORITHMS, _new_hashers
+
+
+class HashingReader(io.RawIOBase):
+    """A seekable file wrapper that hashes the bytes read through it.
+
+    The bytes are hashed as long as they are read in order from the start of
+    the file. Reads elsewhere (e.g., a zip central directory at the end of
+    the file) are not hashed, and `hexdigests` reads whatever was not hashed
+    yet, from the hashed frontier to the end. A streamed tarball is thus
+    hashed and listed with a single read of the file.
+
+    Parameters
+    ----------
+    pth : str
+        The path to the file.
+    algorithms : tuple of str, optional
+        The hashlib algorithms to compute. If empty, nothing is hashed.
+    """
+
+    def __init__(self, pth, algorithms=DEFAULT_ALGORITHMS):
+        self._fp = open(pth, "rb")
+        self._hashers = list(_new_hashers(algorithms).items())
+        self._pos = 0
+        # the number of bytes from the start of the file that were hashed
+        self._frontier = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._pos = self._fp.seek(offset, whence)
+        return self._pos
+
+    def readinto(self, b):
+        n = self._fp.readinto(b)
+        if n and self._hashers and self._pos <= self._frontier < self._pos + n:
+            view = memoryview(b)[self._frontier - self._pos:n]
+            for _, h in self._hashers:
+                h.update(view)
+            self._frontier = self._pos + n
+        self._pos += n or 0
+        return n
+
+    def hexdigests(self):
+        """Finish hashing the rest of the file and return the hex digests."""
+        if not self._hashers:
+            return {}
+        self.seek(self._frontier)
+        buf = bytearray(BUFFER_SIZE)
+        while self.readinto(buf):
+            pass
+        return {algo: h.hexdigest() for algo, h in self._hashers}
+
+    def close(self):
+        self._fp.close()
+        super().close()
+
+
+def _file_record(member):
+    if member.isdir():
+        kind = "dir"
+    elif member.issym():
+        kind = "symlink"
+    elif member.islnk():
+        kind = "hardlink"
+    else:
+        kind = "file"
+    record = {
+        "name": member.name,
+        "size": member.size,
+        "type": kind,
+        "mode": member.mode,
+        "owner": "%s/%s" % (member.uname or member.uid, member.gname or member.gid),
+        "mtime": member.mtime,
+    }
+    if member.issym() or member.islnk():
+        record["target"] = member.linkname
+    return record
+
+
+# the metadata read from the info of a package
+PATHS_JSON = "info/paths.json"
+INDEX_JSON = "info/index.json"
+
+# path_type in paths.json -> type of the file records
+_PATH_TYPES = {
+    "hardlink": "file",
+    "softlink": "symlink",
+    "directory": "dir",
+}
+
+
+def _list_tar_stream(fileobj, mode="r|", capture=()):
+    """List a streamed tarball, keeping the contents of the `capture` members."""
+    files = []
+    captured = {}
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+        for member in tar:
+            files.append(_file_record(member))
+            if member.name in capture and member.isfile():
+                captured[member.name] = tar.extractfile(member).read()
+    return files, captured
+
+
+def _conda_members(zf, prefix):
+    return [
+        info for info in zf.infolist()
+        if info.filename.startswith(prefix) and info.filename.endswith(".tar.zst")
+    ]
+
+
+def _list_zst_member(zf, info, capture=()):
+    import zstandard
+
+    with zf.open(info) as member:
+        dctx = zstandard.ZstdDecompressor()
+        with dctx.stream_reader(member) as tar_stream:
+            return _list_tar_stream(tar_stream, capture=capture)
+
+
+def _list_conda(reader):
+    files = []
+    captured = {}
+    with zipfile.ZipFile(reader) as zf:
+        # read the members in file order so the hashing stays contiguous
+        for info in sorted(_conda_members(zf, ""), key=lambda i: i.header_offset):
+            member_files, member_captured = _list_zst_member(
+                zf, info, capture=(PATHS_JSON, INDEX_JSON),
+            )
+            files.extend(member_files)
+            captured.update(member_captured)
+    return files, captured
+
+
+def _list_conda_metadata(reader):
+    """List a `.conda` artifact from its info only, or return None if it cannot be.
+
+    Only the zip central directory and the small `info-*.tar.zst` member are
+    read. The payload files, sizes and sha256s come from `info/paths.json`.
+    """
+    with zipfile.ZipFile(reader) as zf:
+        infos = _conda_members(zf, "info-")
+        if len(infos) != 1:
+            return None
+        files, captured = _list_zst_member(zf, infos[0], capture=(PATHS_JSON, INDEX_JSON))
+
+    if PATHS_JSON not in captured:
+        return None
+    paths = json.loads(captured[PATHS_JSON]).get("paths", [])
+    if any("size_in_bytes" not in p for p in paths if p.get("path_type") != "directory"):
+        return None
+
+    for p in paths:
+        record = {
+            "name": p["_path"],
+            "size": p.get("size_in_bytes", 0),
+            "type": _PATH_TYPES.get(p.get("path_type"), "file"),
+            "mode": None,
+            "owner": None,
+            "mtime": None,
+        }
+        if "sha256" in p:
+            record["sha256"] = p["sha256"]
+        files.append(record)
+    return files, captured
+
+
+def _add_sha256s(files, captured):
+    """Add the sha256 of each payload file from `info/paths.json`, if known."""
+    if PATHS_JSON not in captured:
+        return
+    sha256s = {
+        p["_path"]: p["sha256"]
+        for p in json.loads(captured[PATHS_JSON]).get("paths", [])
+        if "sha256" in p
+    }
+    for record in files:
+        if "sha256" not in record and record["name"] in sha256s:
+            record["sha256"] = sha256s[record["name"]]
+
+
+def list_artifact(pth, algorithms=DEFAULT_ALGORITHMS, full=False):
+    """List the files in a conda artifact and hash it with one read of the file.
+
+    For `.conda` artifacts, only the info is decompressed and the payload
+    files are taken from `info/paths.json` unless `full` is True. The
+    inspection time then does not depend on the size of the payload.
+
+    Parameters
+    ----------
+    pth : str
+        The path to the `.tar.bz2` or `.conda` artifact.
+    algorithms : tuple of str, optional
+        The hashlib algorithms to compute, or an empty tuple to skip hashing
+        (e.g., if the digests are cached).
+    full : bool, optional
+        If True, decompress and list the whole payload of `.conda` artifacts.
+
+    Returns
+    -------
+    files : list of dict
+        The name, size, type, mode, owner and mtime of each entry in the
+        package, plus the sha256 of the payload files listed in
+        `info/paths.json`. Entries taken from `info/paths.json` alone have no
+        mode, owner or mtime.
+    digests : dict
+        A dict mapping each algorithm to its hex digest.
+    index : dict or None
+        The `info/index.json` of the package.
+    """
+    reader = HashingReader(pth, algorithms=algorithms)
+    try:
+        listed = None
+        if pth.endswith(".conda"):
+            if not full:
+                listed = _list_conda_metadata(reader)
+            if listed is None:
+                listed = _list_conda(reader)
+        else:
+            buffered = io.BufferedReader(reader, BUFFER_SIZE)
+            listed = _list_tar_stream(buffered, mode="r|*", capture=(PATHS_JSON, INDEX_JSON))
+            # keep the reader open to finish the hashing
+            buffered.detach()
+        digests = reader.hexdigests()
+    finally:
+        reader.close()
+
+    files, captured = listed
+    _add_sha256s(files, captured)
+    files.sort(key=lambda f: f["name"])
+    index = json.loads(captured[INDEX_JSON]) if INDEX_JSON in captured else None
+    return files, digests, index
+
+
+def format_file_record(record):
+    """Format a file like the verbose listing of `tar -tv`."""
+    name = record["name"]
+    if record["mode"] is None:
+        # only the size and the hash are known from info/paths.json
+        return "%10d %s %s" % (record["size"], record.get("sha256", "-" * 64), name)
+
+    mtime = time.localtime(record["mtime"])
+    if record["type"] == "dir":
+        name += "/"
+    elif record["type"] == "symlink":
+        name += " -> " + record["target"]
+    elif record["type"] == "hardlink":
+        name += " link to " + record["target"]
+    mode = record["mode"] | {
+        "dir": stat.S_IFDIR, "symlink": stat.S_IFLNK,
+    }.get(record["type"], stat.S_IFREG)
+    return "%s %s %10d %d-%02d-%02d %02d:%02d:%02d %s" % (
+        stat.filemode(mode),
+        record["owner"],
+        record["size"],
+        *mtime[:6],
+        name,
+    )
@@ -0,0 +1,84 @@
+import itertools
+import os
+
+from .utils import human_readable_bytes
+
+
+def build_content_index(reports, min_size=1):
+    """Index the files of several artifacts by the sha256 of their content.
+
+    Only regular files with a known sha256 (from `info/paths.json`) and at
+    least `min_size` bytes are indexed.
+
+    Parameters
+    ----------
+    reports : dict
+        The reports of `inspect_artifact` keyed on path.
+    min_size : int, optional
+        The smallest file size to index.
+
+    Returns
+    -------
+    index : dict
+        Maps each sha256 to `(size, {artifact: [file names]})`.
+    """
+    index = {}
+    for artifact, report in reports.items():
+        for record in report["files"]:
+            if record["type"] != "file" or "sha256" not in record:
+                continue
+            if record["size"] < min_size:
+                continue
+            size, where = index.setdefault(record["sha256"], (record["size"], {}))
+            where.setdefault(artifact, []).append(record["name"])
+    return index
+
+
+def find_duplicate_content(reports, min_size=1):
+    """Find the file contents shipped by more than one artifact.
+
+    Parameters
+    ----------
+    reports : dict
+        The reports of `inspect_artifact` keyed on path.
+    min_size : int, optional
+        The smallest file size to consider.
+
+    Returns
+    -------
+    pairs : list of dict
+        For each pair of artifacts sharing content, the artifacts, the number
+        of shared files, the shared bytes and the shared files (largest
+        first), sorted by the shared bytes.
+    """
+    pairs = {}
+    for sha256, (size, where) in build_content_index(reports, min_size=min_size).items():
+        if len(where) < 2:
+            continue
+        for a, b in itertools.combinations(sorted(where), 2):
+            pair = pairs.setdefault((a, b), {"n_files": 0, "bytes": 0, "files": []})
+            pair["n_files"] += 1
+            pair["bytes"] += size
+            pair["files"].append({
+                "size": size, "sha256": sha256, "names": [where[a][0], where[b][0]],
+            })
+
+    results = []
+    for (a, b), pair in pairs.items():
+        pair["files"].sort(key=lambda f: f["size"], reverse=True)
+        results.append(dict(outputs=[a, b], **pair))
+    results.sort(key=lambda p: p["bytes"], reverse=True)
+    return results
+
+
+def print_duplicate_content(pairs, croot, top_n=5):
+    if not pairs:
+        print("-- No file contents are shared between the artifacts.")
+        return
+    for pair in pairs:
+        a, b = (os.path.relpath(o, croot) for o in pair["outputs"])
+        print("-- %s and %s share %d file(s), %s:" % (
+            a, b, pair["n_files"], human_readable_bytes(pair["bytes"])))
+        for f in pair["files"][:top_n]:
+            names = f["names"][0] if f["names"][0] == f["names"][1] else " / ".join(f["names"])
+            print("   %10s %s" % (human_readable_bytes(f["size"]), names))
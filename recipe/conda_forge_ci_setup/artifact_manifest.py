@@ -0,0 +1,151 @@
+import json
+import os
+import re
+
+from .utils import human_readable_bytes
+
+ARTIFACT_MANIFEST_NAME = "artifact_manifest.json"
+
+# the metrics compared against the baseline and how to print them
+METRICS = {
+    "compressed_size": human_readable_bytes,
+    "total_size": human_readable_bytes,
+    "n_files": str,
+}
+
+# the build number and hash of a build string change between builds
+_BUILD_NUMBER_RE = re.compile(r"(^|_)\d+$")
+_BUILD_HASH_RE = re.compile(r"h[0-9a-f]{7}$")
+
+
+def manifest_key(relpath, index, detail=0):
+    """Get a key for an artifact that is stable across builds of the recipe.
+
+    The key is the subdir, name and build string without the hash and build
+    number (e.g. `linux-64/foo-py312`), so that each variant is compared
+    with the same variant of the baseline. With `detail=1` the file extension
+    is added, and with `detail=2` the key is the artifact path itself.
+    """
+    if detail >= 2:
+        return relpath
+    if index:
+        subdir, name, build = index["subdir"], index["name"], index["build"]
+    else:
+        subdir, fn = relpath.split("/")[-2:]
+        name, _, build = fn.rsplit("-", 2)
+        build = build.split(".")[0]
+    build = _BUILD_HASH_RE.sub("", _BUILD_NUMBER_RE.sub("", build)).rstrip("_")
+    key = "%s/%s-%s" % (subdir, name, build) if build else "%s/%s" % (subdir, name)
+    if detail == 1:
+        key += ".conda" if relpath.endswith(".conda") else ".tar.bz2"
+    return key
+
+
+def build_manifest(reports, croot, top_n=10):
+    """Summarize the reports of `inspect_artifacts` in a compact manifest.
+
+    Parameters
+    ----------
+    reports : dict
+        The reports of `inspect_artifact` keyed on path.
+    croot : str
+        The conda-build root directory the paths are relative to.
+    top_n : int, optional
+        The number of largest files to list per artifact.
+
+    Returns
+    -------
+    manifest : dict
+        The artifact, compressed size, total size of the files, file count
+        and largest files keyed on `manifest_key`. Artifacts that would share
+        a key (e.g. the `.tar.bz2` and `.conda` of a build or variants that
+        only differ by hash) get more detailed keys instead.
+    """
+    entries = {}
+    for artifact, report in reports.items():
+        relpath = os.path.relpath(artifact, croot).replace(os.sep, "/")
+        files = [f for f in report["files"] if f["type"] != "dir"]
+        largest = sorted(files, key=lambda f: f["size"], reverse=True)[:top_n]
+        entries[relpath] = (report.get("index"), {
+            "artifact": relpath,
+            "compressed_size": report["size"],
+            "total_size": sum(f["size"] for f in files),
+            "n_files": len(files),
+            "largest_files": [{"name": f["name"], "size": f["size"]} for f in largest],
+        })
+
+    manifest = {}
+    pending = sorted(entries)
+    for detail in range(3):
+        by_key = {}
+        for relpath in pending:
+            by_key.setdefault(
+                manifest_key(relpath, entries[relpath][0], detail=detail), []
+            ).append(relpath)
+        pending = []
+        for key, relpaths in by_key.items():
+            if len(relpaths) == 1 and key not in manifest:
+                manifest[key] = entries[relpaths[0]][1]
+            else:
+                pending.extend(relpaths)
+        if pending and detail < 2:
+            print("-- using more detailed manifest keys for: %s" % ", ".join(pending))
+    if pending:
+        raise RuntimeError("duplicate artifact manifest keys for: %s" % ", ".join(pending))
+    return manifest
+
+
+def read_baseline(pth):
+    """Read a baseline manifest, raising if it is not a valid manifest."""
+    try:
+        with open(pth) as fp:
+            baseline = json.load(fp)
+    except (OSError, ValueError) as e:
+        raise RuntimeError("could not read the baseline manifest %s: %r" % (pth, e))
+    if not isinstance(baseline, dict) or not all(
+        isinstance(entry, dict) for entry in baseline.values()
+    ):
+        raise RuntimeError("%s is not an artifact manifest!" % pth)
+    return baseline
+
+
+def compare_manifests(manifest, baseline, max_size_growth, max_file_count_growth):
+    """Compare a manifest against the manifest of a previous build.
+
+    Parameters
+    ----------
+    manifest, baseline : dict
+        The outputs of `build_manifest`.
+    max_size_growth : float
+        The allowed growth of the compressed and total sizes in percent.
+    max_file_count_growth : float
+        The allowed growth of the file count in percent.
+
+    Returns
+    -------
+    violations : list of str
+        A message for each metric that grew more than allowed or is missing
+        from the baseline.
+    """
+    limits = {
+        "compressed_size": max_size_growth,
+        "total_size": max_size_growth,
+        "n_files": max_file_count_growth,
+    }
+    violations = []
+    for key in sorted(manifest):
+        if key not in baseline:
+            print("-- %s: not in the baseline" % key)
+            continue
+        for metric, fmt in METRICS.items():
+            if not isinstance(baseline[key], dict) or metric not in baseline[key]:
+                violations.append("%s %s: missing from the baseline" % (key, metric))
+                continue
+            old, new = baseline[key][metric], manifest[key][metric]
+            growth = 100.0 * (new - old) / old if old else (0.0 if new == old else float("inf"))
+            msg = "%s %s: %s -> %s (%+.1f%%)" % (key, metric, fmt(old), fmt(new), growth)
+            if growth > limits[metric]:
+                violations.append(msg)
+            else:
+                print("-- " + msg)
+    return violations
@@ -33,6 +33,8 @@ import click
 
 from conda_forge_ci_setup.upload_or_check_non_existence import retry_upload_or_check
 
+from .feedstock_config import get_feedstock_config
+from .fs_utils import write_text_atomic
 from .feedstock_outputs import STAGING
 
 call = subprocess.check_call
@@ -63,12 +65,10 @@ arg_config_file = click.argument(
 
 def update_global_config(feedstock_root):
     """Merge the conda-forge.yml with predefined system defaults"""
-    if os.path.exists(os.path.join(feedstock_root, "conda-forge.yml")):
-        with open(os.path.join(feedstock_root, "conda-forge.yml")) as f:
-            repo_config = safe_load(f)
-        for k1, k2 in [("channels", "sources"), ("channels", "targets")]:
-            if (k1 in repo_config) and (k2 in repo_config[k1]):
-                _global_config[k1][k2] = repo_config[k1][k2]
+    repo_config = get_feedstock_config(feedstock_root)
+    for k in ["sources", "targets"]:
+        if repo_config.channels(k) is not None:
+            _global_config["channels"][k] = repo_config.channels(k)
 
 
 def fail_if_outdated_windows_ci(feedstock_root):
@@ -90,24 +90,23 @@ def fail_if_outdated_windows_ci(feedstock_root):
     else:
         return
 
-    with open(os.path.join(feedstock_root, "conda-forge.yml")) as f:
-        config = safe_load(f)
-        if "provider" in config and "win" in config["provider"]:
-            provider_cfg = config["provider"]["win"]
-            if provider_cfg != "azure":
-                return
-            if provider == "appveyor":
-                raise RuntimeError(
-                    "This PR needs a rerender to switch from appveyor to azure")
-            if (
-                provider == "azure"
-                and (
-                    os.getenv("UPLOAD_PACKAGES", "False") == "False"
-                    or os.path.exists(".appveyor.yml")
-                )
-            ):
-                raise RuntimeError(
-                    "This PR needs a rerender to switch from appveyor to azure")
+    config = get_feedstock_config(feedstock_root)
+    if "win" in config.provider:
+        provider_cfg = config.provider["win"]
+        if provider_cfg != "azure":
+            return
+        if provider == "appveyor":
+            raise RuntimeError(
+                "This PR needs a rerender to switch from appveyor to azure")
+        if (
+            provider == "azure"
+            and (
+                os.getenv("UPLOAD_PACKAGES", "False") == "False"
+                or os.path.exists(".appveyor.yml")
+            )
+        ):
+            raise RuntimeError(
+                "This PR needs a rerender to switch from appveyor to azure")
 
 
 def fail_if_travis_not_allowed_for_arch(config_file, feedstock_root):
@@ -131,23 +130,88 @@ def fail_if_travis_not_allowed_for_arch(config_file, feedstock_root):
         raise RuntimeError("Travis CI cannot be used on x86_64 in conda-forge!")
 
 
-def maybe_use_dot_conda(feedstock_root):
-    """Maybe set the .condarc to use .conda files."""
-    if os.path.exists(os.path.join(feedstock_root, "conda-forge.yml")):
-        with open(os.path.join(feedstock_root, "conda-forge.yml")) as f:
-            repo_config = safe_load(f)
+def _env_condarc_path():
+    # this is the file `conda config --env` edits
+    return os.path.join(os.environ.get("CONDA_PREFIX", sys.prefix), ".condarc")
+
 
-        conda_build_config_vars = repo_config.get("conda_build", {})
+def _condarc_round_trip():
+    """Get YAML round-trip load/dump functions matching `conda config`."""
+    try:
+        from conda.common.serialize import yaml_round_trip_dump, yaml_round_trip_load
+    except ImportError:
+        from io import StringIO
+        from ruamel.yaml import YAML as _YAML
+
+        def _yaml():
+            yaml = _YAML(typ="rt")
+            yaml.indent(mapping=2, offset=2, sequence=4)
+            return yaml
+
+        def yaml_round_trip_load(stream):
+            return _yaml().load(stream)
+
+        def yaml_round_trip_dump(data):
+            stream = StringIO()
+            _yaml().dump(data, stream)
+            return stream.getvalue()
+
+    return yaml_round_trip_load, yaml_round_trip_dump
+
+
+def read_env_condarc():
+    """Read the .condarc of the active environment."""
+    yaml_round_trip_load, _ = _condarc_round_trip()
+    rc_path = _env_condarc_path()
+    if os.path.isfile(rc_path):
+        with open(rc_path) as fh:
+            return yaml_round_trip_load(fh) or {}
+    return {}
+
+
+def write_env_condarc(rc_config):
+    """Atomically write the .condarc of the active environment."""
+    _, yaml_round_trip_dump = _condarc_round_trip()
+    write_text_atomic(_env_condarc_path(), yaml_round_trip_dump(rc_config))
+
+
+def _condarc_remove_channel(rc_config, channel):
+    # same as `conda config --remove channels <channel>`, where a missing
+    # channels key stands for ["defaults"] and a missing channel is an error
+    # we ignore
+    if "channels" not in rc_config:
+        rc_config["channels"] = ["defaults"]
+    if channel in rc_config["channels"]:
+        rc_config["channels"] = [c for c in rc_config["channels"] if c != channel]
+
+
+def _condarc_add_channel(rc_config, channel):
+    # same as `conda config --add channels <channel>`
+    if "channels" not in rc_config:
+        rc_config["channels"] = ["defaults"]
+    channels = rc_config["channels"]
+    if channel in channels:
+        print(
+            "Warning: '%s' already in 'channels' list, moving to the top" % channel,
+            file=sys.stderr,
+        )
+        channels = rc_config["channels"] = [c for c in channels if c != channel]
+    channels.insert(0, channel)
+
+
+def maybe_use_dot_conda(feedstock_root, rc_config):
+    """Maybe set the .condarc to use .conda files."""
+    repo_config = get_feedstock_config(feedstock_root)
+    if repo_config.exists:
+        conda_build_config_vars = repo_config.conda_build
         for k, v in cf_conda_build_defaults.items():
             if k not in conda_build_config_vars:
                 conda_build_config_vars[k] = v
 
         for k, v in conda_build_config_vars.items():
             if v is not None:
-                call([
-                    "conda", "config", "--env", "--set",
-                    f"conda_build.{k}", str(v)
-                ])
+                # same as `conda config --set conda_build.<k> <v>`
+                rc_config.setdefault("conda_build", {})[k] = str(v)
 
 
 @click.command()
@@ -160,7 +224,12 @@ def setup_conda_rc(feedstock_root, recipe_root, config_file):
 
     fail_if_travis_not_allowed_for_arch(config_file, feedstock_root)
 
-    maybe_use_dot_conda(feedstock_root)
+    # The final env .condarc is computed in memory and written once. This is
+    # equivalent to (but much faster than) the sequence of
+    # `conda config --env` calls noted below.
+    rc_config = read_env_condarc()
+
+    maybe_use_dot_conda(feedstock_root, rc_config)
 
     with open(config_file) as f:
         specific_config = safe_load(f)
@@ -186,15 +255,17 @@ def setup_conda_rc(feedstock_root, recipe_root, config_file):
             update_global_config(feedstock_root)
             channels = _global_config["channels"]["sources"]
 
-        try:
-            call(["conda", "config", "--env", "--remove", "channels", "defaults"])
-        except subprocess.CalledProcessError:
-            pass
+        # conda config --env --remove channels defaults
+        _condarc_remove_channel(rc_config, "defaults")
 
+        # conda config --env --add channels <c>
         for c in reversed(channels):
-            call(["conda", "config", "--env", "--add", "channels", c])
+            _condarc_add_channel(rc_config, c)
 
-        call(["conda", "config", "--env", "--set", "show_channel_urls", "true"])
+        # conda config --env --set show_channel_urls true
+        rc_config["show_channel_urls"] = True
+
+    write_env_condarc(rc_config)
 
 
 @click.command()
@@ -204,7 +275,20 @@ def setup_conda_rc(feedstock_root, recipe_root, config_file):
 @click.option("--validate", is_flag=True)
 @click.option("--private", is_flag=True)
 @click.option("--feedstock-name", type=str, default=None)
-def upload_package(feedstock_root, recipe_root, config_file, validate, private, feedstock_name):
+@click.option(
+    "--jobs", "-j", default=1, type=click.IntRange(min=1), envvar="CF_UPLOAD_JOBS",
+    show_default=True, help="the maximum number of concurrent uploads",
+)
+@click.option(
+    "--copy-batch-size", default=0, type=click.IntRange(min=0), envvar="CF_COPY_BATCH_SIZE",
+    show_default=True,
+    help="request copies to production in batches of this many distributions "
+    "while the uploads continue (0 copies everything after the uploads)",
+)
+def upload_package(
+    feedstock_root, recipe_root, config_file, validate, private, feedstock_name, jobs,
+    copy_batch_size,
+):
     if feedstock_name is None and validate:
         raise RuntimeError("You must supply the --feedstock-name option if validating!")
     if feedstock_name and "/" in feedstock_name:
@@ -270,13 +354,14 @@ def upload_package(feedstock_root, recipe_root, config_file, validate, private,
             retry_upload_or_check(
                 feedstock_name, recipe_root, STAGING, channel,
                 [config_file], validate=True, git_sha=git_sha,
-                feedstock_root=feedstock_root,
+                feedstock_root=feedstock_root, jobs=jobs,
+                copy_batch_size=copy_batch_size,
             )
         else:
             retry_upload_or_check(
                 feedstock_name, recipe_root, owner, channel,
                 [config_file], validate=False, private_upload=private,
-                feedstock_root=feedstock_root,
+                feedstock_root=feedstock_root, jobs=jobs,
             )
 
 
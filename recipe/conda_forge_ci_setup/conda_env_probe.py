@@ -0,0 +1,137 @@
+import os
+
+import click
+
+from .fs_utils import read_json, write_json_atomic
+
+CONDA_ENV_PROBE_NAME = "conda_env_probe.json"
+
+
+def default_probe_path():
+    """The snapshot location in conda-build's root workspace (build_artifacts)."""
+    return os.path.join(
+        os.environ.get("CONDA_BLD_PATH", os.path.join(os.getcwd(), "build_artifacts")),
+        CONDA_ENV_PROBE_NAME,
+    )
+
+
+def _virtual_packages(context):
+    try:
+        records = context.plugin_manager.get_virtual_package_records()
+    except AttributeError:
+        from conda.core.index import _supplement_index_with_system
+
+        index = {}
+        _supplement_index_with_system(index)
+        records = index.values()
+    return [
+        {"name": rec.name, "version": rec.version, "build": rec.build}
+        for rec in records
+    ]
+
+
+def probe_conda_env():
+    """Collect the state of the active conda installation in this process.
+
+    This replaces separate `conda info --json`, `conda config --show-sources`
+    and `conda list` calls, which each start conda again.
+
+    Returns
+    -------
+    snapshot : dict
+        The platform, virtual packages, channels, config sources and
+        installed packages of the target prefix.
+    """
+    from conda import __version__ as conda_version
+    from conda.base.context import context
+    from conda.core.prefix_data import PrefixData
+
+    packages = []
+    for rec in sorted(PrefixData(context.target_prefix).iter_records(), key=lambda r: r.name):
+        packages.append({
+            "name": rec.name,
+            "version": rec.version,
+            "build": rec.build,
+            "channel": str(rec.channel.canonical_name) if rec.channel else None,
+            "channel_url": str(rec.channel.base_url) if rec.channel else None,
+        })
+
+    return {
+        "conda_version": conda_version,
+        "platform": context.subdir,
+        "root_prefix": context.root_prefix,
+        "target_prefix": context.target_prefix,
+        "channels": list(context.channels),
+        "channel_priority": str(context.channel_priority),
+        "virtual_packages": _virtual_packages(context),
+        "config_sources": {
+            str(source): {k: _jsonable(v) for k, v in params.items()}
+            for source, params in context.collect_all().items()
+        },
+        "packages": packages,
+    }
+
+
+def _jsonable(value):
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    return str(value)
+
+
+def print_snapshot(snapshot):
+    print("conda version : %s" % snapshot["conda_version"])
+    print("platform : %s" % snapshot["platform"])
+    print("root prefix : %s" % snapshot["root_prefix"])
+    print("target prefix : %s" % snapshot["target_prefix"])
+    print("channel priority : %s" % snapshot["channel_priority"])
+    print("channels :")
+    for c in snapshot["channels"]:
+        print("  - %s" % c)
+    print("virtual packages :")
+    for vp in snapshot["virtual_packages"]:
+        print("  %s=%s=%s" % (vp["name"], vp["version"], vp["build"]))
+    for source, params in snapshot["config_sources"].items():
+        print("==> %s <==" % source)
+        for k, v in params.items():
+            print("%s: %s" % (k, v))
+    print("packages in %s:" % snapshot["target_prefix"])
+    for pkg in snapshot["packages"]:
+        print("%-40s %-20s %-30s %s" % (
+            pkg["name"], pkg["version"], pkg["build"], pkg["channel_url"] or ""
+        ))
+
+
+@click.command()
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(file_okay=True, dir_okay=False),
+    default=None,
+    help="where to write the JSON snapshot (default: $CONDA_BLD_PATH/%s)" % CONDA_ENV_PROBE_NAME,
+)
+@click.option(
+    "--reuse",
+    is_flag=True,
+    help="use an existing snapshot instead of probing conda again",
+)
+@click.option(
+    "--show",
+    is_flag=True,
+    help="print a summary of the snapshot (like conda info/config/list)",
+)
+def main(output, reuse, show):
+    """Snapshot the conda environment once for the build setup scripts."""
+    if output is None:
+        output = default_probe_path()
+
+    snapshot = read_json(output) if reuse else None
+    if snapshot is None:
+        snapshot = probe_conda_env()
+        write_json_atomic(output, snapshot)
+
+    if show:
+        print_snapshot(snapshot)
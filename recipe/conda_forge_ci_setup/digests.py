@@ -0,0 +1,200 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .fs_utils import file_lock, read_json, stat_key, write_json_atomic
+
+DEFAULT_ALGORITHMS = ("sha256", "md5")
+
+# large enough to amortize the per-read overhead of multi-GB artifacts
+# while keeping one buffer per worker thread cheap
+BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def _new_hashers(algorithms):
+    hashers = {}
+    for algo in algorithms:
+        if algo == "md5":
+            # not used for security purposes, only to compare with anaconda.org
+            hashers[algo] = hashlib.md5(usedforsecurity=False)
+        else:
+            hashers[algo] = hashlib.new(algo)
+    return hashers
+
+
+def compute_digests(pth, algorithms=DEFAULT_ALGORITHMS, buffer_size=BUFFER_SIZE):
+    """Compute several hex digests of a file in a single pass.
+
+    The file is read into one reusable buffer so that no new bytes object
+    is created per chunk.
+
+    Parameters
+    ----------
+    pth : str or os.PathLike
+        The path to the file.
+    algorithms : tuple of str, optional
+        The hashlib algorithms to compute (e.g., "sha256", "md5", "blake2b").
+    buffer_size : int, optional
+        The size of the read buffer in bytes.
+
+    Returns
+    -------
+    digests : dict
+        A dict mapping each algorithm to its hex digest.
+    """
+    hashers = list(_new_hashers(algorithms).items())
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+
+    with open(pth, "rb", buffering=0) as fp:
+        while True:
+            n = fp.readinto(buf)
+            if not n:
+                break
+            chunk = view[:n]
+            for _, h in hashers:
+                h.update(chunk)
+
+    return {algo: h.hexdigest() for algo, h in hashers}
+
+
+def compute_digests_many(paths, algorithms=DEFAULT_ALGORITHMS, max_workers=None):
+    """Compute the digests of several files at once.
+
+    hashlib releases the GIL while hashing large buffers, so a thread pool
+    hashes independent artifacts in parallel.
+
+    Parameters
+    ----------
+    paths : iterable of str or os.PathLike
+        The paths to the files.
+    algorithms : tuple of str, optional
+        The hashlib algorithms to compute.
+    max_workers : int, optional
+        The number of threads to use. Defaults to the number of CPUs (at most 8).
+
+    Returns
+    -------
+    digests : dict
+        A dict mapping each path to the output of `compute_digests`.
+    """
+    paths = list(paths)
+    if not paths:
+        return {}
+    if max_workers is None:
+        max_workers = min(8, os.cpu_count() or 1)
+    max_workers = max(1, min(max_workers, len(paths)))
+
+    if max_workers == 1:
+        return {p: compute_digests(p, algorithms=algorithms) for p in paths}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as exe:
+        results = exe.map(lambda p: compute_digests(p, algorithms=algorithms), paths)
+        return dict(zip(paths, results))
+
+
+# sidecar file kept in conda-build's root workspace (build_artifacts) next to
+# the subdir folders holding the artifacts
+DIGEST_CACHE_NAME = ".artifact_digests.json"
+
+
+def _digest_cache_path(pth):
+    return os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(pth))),
+        DIGEST_CACHE_NAME,
+    )
+
+
+def _is_fresh(entry, key):
+    return entry is not None and all(entry.get(k) == v for k, v in key.items())
+
+
+def get_artifact_digests(paths, max_workers=None):
+    """Get the sha256/md5 digests of built artifacts, hashing only when needed.
+
+    Results are cached in a sidecar file in the conda-build root workspace,
+    keyed on (path, size, mtime_ns, inode), so that every later step of
+    the same job can get a checksum without re-reading the artifact.
+
+    Parameters
+    ----------
+    paths : iterable of str or os.PathLike
+        The paths to the artifacts (e.g., `<croot>/linux-64/foo-1.0-0.conda`).
+    max_workers : int, optional
+        The number of threads to use for artifacts that need to be hashed.
+
+    Returns
+    -------
+    digests : dict
+        A dict mapping each path to a dict with keys `sha256`, `md5`, `size`
+        and `n_files` (the number of files in the package if known, else None).
+    """
+    by_cache = {}
+    for p in paths:
+        by_cache.setdefault(_digest_cache_path(p), []).append(p)
+
+    digests = {}
+    for cache_path, cache_paths in by_cache.items():
+        # hash without holding the lock so that other jobs are not blocked
+        # behind multi-GB reads; the cache is only locked to merge the results
+        cache = read_json(cache_path, default={})
+        keys = {}
+        missing = []
+        for p in cache_paths:
+            apth = os.path.abspath(p)
+            keys[apth] = stat_key(apth)
+            if not _is_fresh(cache.get(apth), keys[apth]):
+                missing.append(apth)
+
+        computed = compute_digests_many(
+            missing, algorithms=DEFAULT_ALGORITHMS, max_workers=max_workers,
+        )
+        if computed:
+            with file_lock(cache_path + ".lock"):
+                cache = read_json(cache_path, default={})
+                for apth, dgsts in computed.items():
+                    # keep an entry another job wrote meanwhile (it may have n_files)
+                    if not _is_fresh(cache.get(apth), keys[apth]):
+                        cache[apth] = dict(keys[apth], n_files=None, **dgsts)
+                write_json_atomic(cache_path, cache)
+
+        for p in cache_paths:
+            entry = cache[os.path.abspath(p)]
+            digests[p] = {
+                k: entry[k] for k in ("sha256", "md5", "size", "n_files")
+            }
+
+    return digests
+
+
+def get_cached_artifact_digests(pth):
+    """Get the cached digests of an artifact without hashing it, or None."""
+    apth = os.path.abspath(pth)
+    entry = read_json(_digest_cache_path(apth), default={}).get(apth)
+    if not _is_fresh(entry, stat_key(apth)):
+        return None
+    return {k: entry[k] for k in ("sha256", "md5", "size", "n_files")}
+
+
+def record_artifact_digests(pth, digests, n_files=None):
+    """Store digests computed elsewhere (e.g., while listing) in the cache."""
+    cache_path = _digest_cache_path(pth)
+    apth = os.path.abspath(pth)
+    with file_lock(cache_path + ".lock"):
+        cache = read_json(cache_path, default={})
+        cache[apth] = dict(
+            stat_key(apth), n_files=n_files, **{k: digests[k] for k in DEFAULT_ALGORITHMS}
+        )
+        write_json_atomic(cache_path, cache)
+
+
+def record_artifact_file_count(pth, n_files):
+    """Store the number of files in an artifact in its digest cache entry."""
+    cache_path = _digest_cache_path(pth)
+    apth = os.path.abspath(pth)
+    with file_lock(cache_path + ".lock"):
+        cache = read_json(cache_path, default={})
+        entry = cache.get(apth)
+        if _is_fresh(entry, stat_key(apth)):
+            entry["n_files"] = n_files
+            write_json_atomic(cache_path, cache)
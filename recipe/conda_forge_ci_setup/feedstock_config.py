@@ -0,0 +1,90 @@
+import os
+
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+import yaml
+
+CONDA_FORGE_YML = "conda-forge.yml"
+
+# parsed configs keyed on path, invalidated when the file changes
+_CONFIG_CACHE = {}
+
+
+class FeedstockConfig:
+    """The parsed `conda-forge.yml` of a feedstock.
+
+    Use `get_feedstock_config` to get an instance so that the file is only
+    parsed once per process. The `data` dict is shared and must not be
+    modified.
+
+    Parameters
+    ----------
+    path : str
+        The path to the `conda-forge.yml` file.
+    data : dict or None
+        The parsed file or None if it does not exist.
+    """
+
+    def __init__(self, path, data):
+        self.path = path
+        self.exists = data is not None
+        self.data = data or {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def channels(self, kind):
+        """Get the channel `sources` or `targets`, or None if not set."""
+        return (self.data.get("channels") or {}).get(kind)
+
+    @property
+    def provider(self):
+        return self.data.get("provider") or {}
+
+    @property
+    def conda_build(self):
+        return dict(self.data.get("conda_build") or {})
+
+    @property
+    def conda_build_tool(self):
+        return self.data.get("conda_build_tool")
+
+    @property
+    def output_validation(self):
+        return self.data.get("conda_forge_output_validation", False)
+
+
+def get_feedstock_config(feedstock_root):
+    """Get the `FeedstockConfig` of a feedstock, parsing it only if it changed.
+
+    Parameters
+    ----------
+    feedstock_root : str or None
+        The feedstock directory. If None, an empty config is returned.
+
+    Returns
+    -------
+    config : FeedstockConfig
+    """
+    if not feedstock_root:
+        return FeedstockConfig(None, None)
+
+    path = os.path.abspath(os.path.join(feedstock_root, CONDA_FORGE_YML))
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        _CONFIG_CACHE.pop(path, None)
+        return FeedstockConfig(path, None)
+
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _CONFIG_CACHE.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    with open(path, "rb") as f:
+        data = yaml.load(f, Loader=_SafeLoader)
+    config = FeedstockConfig(path, data if data is not None else {})
+    _CONFIG_CACHE[path] = (key, config)
+    return config
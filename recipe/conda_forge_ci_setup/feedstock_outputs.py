@@ -4,22 +4,13 @@ import json
 import time
 import sys
 import hmac
-import urllib
 
 import click
-import requests
-import requests.exceptions
-import conda_build.config
-from conda_forge_metadata.feedstock_outputs import (
-    package_to_feedstock,
-    feedstock_outputs_config,
-)
-from binstar_client import BinstarError
-from binstar_client.utils import get_server_api
 
+from .digests import get_artifact_digests
+from .fs_utils import file_lock, get_cache_dir, read_json, write_json_atomic
 from .utils import (
     built_distributions_from_recipe_variant,
-    compute_sha256sum,
     split_pkg,
     is_conda_forge_output_validation_on,
 )
@@ -28,6 +19,14 @@ from .utils import (
 VALIDATION_ENDPOINT = "https://conda-forge.herokuapp.com"
 STAGING = "cf-staging"
 
+# the copy can take a while for many outputs, but should never hang the build
+COPY_TIMEOUT = (10, 300)
+
+# output name -> feedstocks lookups in the per-host cache directory
+OUTPUTS_CACHE_NAME = "package_to_feedstock.json"
+OUTPUTS_CACHE_TTL = 3600
+_LOOKUP_FAILED = "__lookup_failed__"
+
 
 def _unix_dist_path(path):
     return "/".join(path.split(os.sep)[-2:])
@@ -42,47 +41,143 @@ def _get_ac_api(timeout=30):
     else:
         raise RuntimeError("No anaconda.org token found!")
 
+    from binstar_client.utils import get_server_api
+
+    from .http_utils import configure_session
+
     ac = get_server_api(token=token)
-    ac.session.request = functools.partial(ac.session.request, timeout=timeout)
+    configure_session(ac.session, timeout=timeout)
     return ac
 
 
-def _check_dist_with_label_and_hash_on_prod(dist, label, hash_type, hash_value):
-    try:
-        _, name, version, _ = split_pkg(dist)
-    except RuntimeError:
-        print("could not parse dist for existence check: %s" % dist, flush=True)
-        return False
+def _check_dists_with_label_and_hash_on_prod(name, version, dists, label, hash_type):
+    """Check several distributions of one release with a single API call.
 
+    Parameters
+    ----------
+    name : str
+        The package name.
+    version : str
+        The package version.
+    dists : dict
+        The expected hashes keyed on distribution (e.g., `noarch/blah-...conda`).
+    label : str
+        The label the distributions should have.
+    hash_type : str
+        The type of the hashes (e.g., `sha256`).
+
+    Returns
+    -------
+    found : dict
+        True for each distribution that exists with the label and hash and
+        False otherwise.
+    """
+    from binstar_client import BinstarError
+    import requests.exceptions
+
+    found = {dist: False for dist in dists}
     try:
-        ac = _get_ac_api()
-        data = ac.distribution(
-            "conda-forge",
-            name,
-            version,
-            basename=urllib.parse.quote(dist, safe=""),
-        )
-        if label in data.get("labels", []) and hmac.compare_digest(data[hash_type], hash_value):
-            return True
-        else:
-            return False
-    except (BinstarError, requests.exceptions.ReadTimeout):
-        return False
+        data = _get_ac_api().release("conda-forge", name, version)
+    except (BinstarError, requests.exceptions.RequestException):
+        return found
+
+    for file_data in data.get("distributions", []):
+        dist = file_data.get("basename")
+        if (
+            dist in dists
+            and label in file_data.get("labels", [])
+            and file_data.get(hash_type) is not None
+            and hmac.compare_digest(file_data[hash_type], dists[dist])
+        ):
+            found[dist] = True
+    return found
+
+
+def _poll_copied_on_prod(checksums, channel, num_polling_attempts, hash_type="sha256"):
+    """Poll anaconda.org until all distributions are on the production channel.
+
+    The distributions are grouped by package name and version so each poll
+    makes one small API call per release, and the releases are checked
+    concurrently. The interval
+    starts short, is reset when a poll confirms new distributions and doubles
+    (up to 30 seconds) when it does not. Polling stops as soon as all of the
+    distributions are confirmed.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    copied = {o: False for o in checksums}
+    by_release = {}
+    for o, hash_value in checksums.items():
+        try:
+            _, name, version, _ = split_pkg(o)
+        except RuntimeError:
+            print("could not parse dist for existence check: %s" % o, flush=True)
+            continue
+        by_release.setdefault((name, version), {})[o] = hash_value
+
+    delay = 2.0
+    with ThreadPoolExecutor(max_workers=max(min(8, len(by_release)), 1)) as pool:
+        for polling_attempt in range(num_polling_attempts):
+            pending = {}
+            for release, dists in by_release.items():
+                dists = {o: h for o, h in dists.items() if not copied[o]}
+                if dists:
+                    pending[release] = dists
+            if not pending:
+                break
+
+            print(
+                "polling attempt %d of %d in %.0fs for %d release(s)" % (
+                    polling_attempt + 1, num_polling_attempts, delay, len(pending)
+                ),
+                flush=True,
+            )
+            time.sleep(delay)
+
+            n_confirmed = 0
+            for found in pool.map(
+                lambda item: _check_dists_with_label_and_hash_on_prod(
+                    *item[0], item[1], channel, hash_type
+                ),
+                pending.items(),
+            ):
+                for o, ok in found.items():
+                    if ok:
+                        copied[o] = True
+                        n_confirmed += 1
+
+            delay = 2.0 if n_confirmed else min(2 * delay, 30.0)
+
+    return copied
 
 
 def request_copy(
-    feedstock, dists, channel, git_sha=None, comment_on_error=True, num_polling_attempts=5
+    feedstock,
+    dists,
+    channel,
+    git_sha=None,
+    comment_on_error=True,
+    num_polling_attempts=8,
+    artifact_results=None,
 ):
-    checksums = {}
-    for path in dists:
-        dist = _unix_dist_path(path)
-        checksums[dist] = compute_sha256sum(path)
+    """Request a copy of distributions from staging to the production channel.
+
+    If `artifact_results` is a dict, it is updated with True or False for
+    each path in `dists` according to whether that distribution was copied.
+    The return value is True only if the whole copy succeeded.
+    """
+    from .http_utils import get_session
+
+    digests = get_artifact_digests(dists)
+    checksums = {_unix_dist_path(path): digests[path]["sha256"] for path in dists}
 
     if "FEEDSTOCK_TOKEN" not in os.environ or os.environ["FEEDSTOCK_TOKEN"] is None:
         print(
             "ERROR you must have defined a FEEDSTOCK_TOKEN in order to "
             "perform output copies to the production channels!"
         )
+        if artifact_results is not None:
+            artifact_results.update({path: False for path in dists})
         return False
 
     headers = {"FEEDSTOCK_TOKEN": os.environ["FEEDSTOCK_TOKEN"]}
@@ -96,13 +191,14 @@ def request_copy(
     }
     if git_sha is not None:
         json_data["git_sha"] = git_sha
-    r = requests.post(
-        "%s/feedstock-outputs/copy" % VALIDATION_ENDPOINT,
-        headers=headers,
-        json=json_data,
-    )
-
+    r = None
     try:
+        r = get_session().post(
+            "%s/feedstock-outputs/copy" % VALIDATION_ENDPOINT,
+            headers=headers,
+            json=json_data,
+            timeout=COPY_TIMEOUT,
+        )
         r.raise_for_status()
         results = r.json()
     except Exception as e:
@@ -110,27 +206,111 @@ def request_copy(
             "ERROR failure in output copy from cf-staging to conda-forge:"
             "\n    error: %s\n    response text: %s" % (
                 repr(e),
-                r.text,
+                r.text if r is not None else "",
             ),
             flush=True,
         )
         print("polling anaconda.org to see if copy completes in the background...", flush=True)
-        results = {"copied": {o: False for o in checksums.keys()}}
-        for polling_attempt in range(num_polling_attempts):
-            print("polling attempt %d of %d" % (polling_attempt+1, num_polling_attempts), flush=True)
-            time.sleep(max(2.0 * 2**polling_attempt, 10))  # wait at least 10 seconds
-            for o in checksums:
-                if not results["copied"][o]:
-                    results["copied"][o] = _check_dist_with_label_and_hash_on_prod(dist, channel, "sha256", checksums[o])
-
-            if all(v for v in results["copied"].values()):
-                break
+        results = {
+            "copied": _poll_copied_on_prod(checksums, channel, num_polling_attempts)
+        }
 
     print("copy results:\n%s" % json.dumps(results, indent=2), flush=True)
-    return (r.status_code == 200) or all(v for v in results["copied"].values())
+    ok = (r is not None and r.status_code == 200) or all(v for v in results["copied"].values())
+    if artifact_results is not None:
+        copied = results.get("copied") or {}
+        for path in dists:
+            artifact_results[path] = bool(copied.get(_unix_dist_path(path), ok))
+    return ok
+
+
+def _outputs_cache_ttl():
+    return float(
+        os.environ.get("CONDA_FORGE_CI_SETUP_OUTPUTS_CACHE_TTL", OUTPUTS_CACHE_TTL)
+    )
+
+
+def _fetch_registered_feedstocks(name):
+    """Look up the feedstocks allowed to make the output `name`.
+
+    Returns the list of feedstocks, None if the output is not registered, or
+    `_LOOKUP_FAILED` if the lookup did not work after three attempts.
+    """
+    from conda_forge_metadata.feedstock_outputs import package_to_feedstock
+    import requests.exceptions
+
+    for i in range(3):  # three attempts
+        try:
+            return list(package_to_feedstock(name))
+        except requests.exceptions.HTTPError as exc:
+            if exc.response.status_code == 404:
+                # no output exists
+                return None
+            elif i < 2:
+                # wait and retry
+                time.sleep(1)
+            else:
+                # last attempt, i==2, did not work
+                # This should rarely happen, if ever
+                print(
+                    "ERROR: Assuming package not allowed. "
+                    f"Failed to get feedstock data. {type(exc)}: {exc}"
+                )
+    return _LOOKUP_FAILED
+
+
+def get_registered_feedstocks(names):
+    """Look up the feedstocks allowed to make each output name.
+
+    Each name is looked up once and the lookups run concurrently. The results
+    (including unregistered names) are kept in an on-disk cache in the
+    per-host cache directory for `CONDA_FORGE_CI_SETUP_OUTPUTS_CACHE_TTL`
+    seconds (default one hour), so repeated validations on a build host
+    make no network calls. Failed lookups are not cached.
 
+    Parameters
+    ----------
+    names : iterable of str
+        The output names.
 
-def is_valid_feedstock_output(project, outputs):
+    Returns
+    -------
+    feedstocks : dict
+        The list of feedstocks keyed on name, None for names that are not
+        registered or `_LOOKUP_FAILED` for names that could not be looked up.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    names = sorted(set(names))
+    cache_path = os.path.join(get_cache_dir(), OUTPUTS_CACHE_NAME)
+    ttl = _outputs_cache_ttl()
+    now = time.time()
+
+    cache = read_json(cache_path, default={})
+    feedstocks = {}
+    for name in names:
+        entry = cache.get(name)
+        if entry is not None and now - entry["time"] < ttl:
+            feedstocks[name] = entry["feedstocks"]
+
+    missing = [name for name in names if name not in feedstocks]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(8, len(missing))) as pool:
+            fetched = dict(zip(missing, pool.map(_fetch_registered_feedstocks, missing)))
+        feedstocks.update(fetched)
+
+        with file_lock(cache_path + ".lock"):
+            cache = read_json(cache_path, default={})
+            for name, value in fetched.items():
+                if value is not _LOOKUP_FAILED:
+                    cache[name] = {"time": now, "feedstocks": value}
+            cache = {k: v for k, v in cache.items() if now - v["time"] < ttl}
+            write_json_atomic(cache_path, cache)
+
+    return feedstocks
+
+
+def is_valid_feedstock_output(project, outputs, outputs_index=None):
     """Test if feedstock outputs are valid (i.e., the outputs are allowed for that
     feedstock). Optionally register them if they do not exist.
 
@@ -143,6 +323,9 @@ def is_valid_feedstock_output(project, outputs):
         A list of outputs top validate. The list entries should be the
         full names with the platform directory, version/build info, and file extension
         (e.g., `noarch/blah-fa31b0-2020.04.13.15.54.07-py_0.tar.bz2`).
+    outputs_index : FeedstockOutputsIndex, optional
+        A local feedstock outputs index. If given, it is used instead of the
+        network for the lookups and the config.
 
     Returns
     -------
@@ -159,35 +342,37 @@ def is_valid_feedstock_output(project, outputs):
 
     valid = {o: False for o in outputs}
 
+    names = {}
     for dist in outputs:
         try:
             _, o, _, _ = split_pkg(dist)
         except RuntimeError:
             continue
+        names[dist] = o
 
-        for i in range(3):  # three attempts
-            try:
-                registered_feedstocks = package_to_feedstock(o)
-            except requests.exceptions.HTTPError as exc:
-                if exc.response.status_code == 404:
-                    # no output exists so see if we can add it
-                    valid[dist] = feedstock_outputs_config().get("auto_register_all", False)
-                    break
-                elif i < 2:
-                    # wait and retry
-                    time.sleep(1)
-                else:
-                    # last attempt, i==2, did not work
-                    # This should rarely happen, if ever
-                    print(
-                        "ERROR: Assuming package not allowed. "
-                        f"Failed to get feedstock data. {type(exc)}: {exc}"
-                    )
-                    valid[dist] = False
-            else:
-                # make sure feedstock is ok
-                valid[dist] = feedstock in registered_feedstocks
-                break
+    if outputs_index is not None:
+        registered = {o: outputs_index.feedstocks(o) for o in set(names.values())}
+    else:
+        registered = get_registered_feedstocks(names.values())
+
+    if any(registered[o] is None for o in names.values()):
+        if outputs_index is not None:
+            config = outputs_index.config
+        else:
+            from conda_forge_metadata.feedstock_outputs import feedstock_outputs_config
+
+            config = feedstock_outputs_config()
+        auto_register_all = config.get("auto_register_all", False)
+    for dist, o in names.items():
+        registered_feedstocks = registered[o]
+        if registered_feedstocks is _LOOKUP_FAILED:
+            valid[dist] = False
+        elif registered_feedstocks is None:
+            # no output exists so see if we can add it
+            valid[dist] = auto_register_all
+        else:
+            # make sure feedstock is ok
+            valid[dist] = feedstock in registered_feedstocks
 
     return valid
 
@@ -208,14 +393,27 @@ def is_valid_feedstock_output(project, outputs):
     default=(),
     help="path to conda_build_config.yaml defining your base matrix",
 )
-def main(feedstock_name, recipe_dir, variant):
+@click.option(
+    '--outputs-index',
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+    default=None,
+    envvar="CF_FEEDSTOCK_OUTPUTS_INDEX",
+    help="a local feedstock outputs index (see build_feedstock_outputs_index) to use instead of the network",
+)
+def main(feedstock_name, recipe_dir, variant, outputs_index):
     """Validate the feedstock outputs."""
-
+    import conda_build.config
 
     if is_conda_forge_output_validation_on():
         distributions = built_distributions_from_recipe_variant(recipe_dir=recipe_dir, variant=variant)
         distributions = [os.path.relpath(p, conda_build.config.croot) for p in distributions]
-        results = is_valid_feedstock_output(feedstock_name, distributions)
+        if outputs_index is not None:
+            from .feedstock_outputs_index import FeedstockOutputsIndex
+
+            outputs_index = FeedstockOutputsIndex(outputs_index)
+        results = is_valid_feedstock_output(
+            feedstock_name, distributions, outputs_index=outputs_index
+        )
 
         print("validation results:\n%s" % json.dumps(results, indent=2), flush=True)
         print(
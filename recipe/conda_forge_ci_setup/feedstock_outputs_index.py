@@ -0,0 +1,364 @@
+import json
+import os
+import sqlite3
+import tarfile
+import tempfile
+import time
+from fnmatch import fnmatch
+
+import click
+
+from .fs_utils import get_cache_dir
+
+FEEDSTOCK_OUTPUTS_INDEX_NAME = "feedstock_outputs.sqlite"
+FEEDSTOCK_OUTPUTS_TARBALL = (
+    "https://github.com/conda-forge/feedstock-outputs/archive/refs/heads/main.tar.gz"
+)
+# the feedstocks allowed to make any output matching some glob patterns
+AUTOREG_ALLOWLIST = "feedstock_outputs_autoreg_allowlist.yml"
+
+
+def default_index_path():
+    return os.path.join(get_cache_dir(), FEEDSTOCK_OUTPUTS_INDEX_NAME)
+
+
+def _parse_output(name, data):
+    if isinstance(data, dict):
+        data = data.get("feedstocks", [])
+    return name, sorted(set(data))
+
+
+def _load_allowlist(fp):
+    import yaml
+
+    return {
+        feedstock: list(patterns or [])
+        for feedstock, patterns in (yaml.safe_load(fp) or {}).items()
+    }
+
+
+def _snapshot_kind(rel):
+    if rel == "config.json":
+        return "config"
+    if rel == AUTOREG_ALLOWLIST:
+        return "allowlist"
+    if rel.startswith("outputs/") and rel.endswith(".json"):
+        return "output"
+    return None
+
+
+def _iter_snapshot_dir(source):
+    """Yield (kind, name, data) from a checkout of the feedstock-outputs repo."""
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for fname in sorted(files):
+            pth = os.path.join(root, fname)
+            kind = _snapshot_kind(os.path.relpath(pth, source).replace(os.sep, "/"))
+            if kind is None:
+                continue
+            with open(pth, "rb") as fp:
+                data = _load_allowlist(fp) if kind == "allowlist" else json.load(fp)
+            yield kind, fname[:-len(".json")] if kind == "output" else None, data
+
+
+def _iter_snapshot_tarball(fileobj):
+    """Yield (kind, name, data) from a streamed tarball of the feedstock-outputs repo."""
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            # drop the top-level directory of the archive
+            rel = member.name.split("/", 1)[-1]
+            kind = _snapshot_kind(rel)
+            if kind is None:
+                continue
+            fp = tar.extractfile(member)
+            data = _load_allowlist(fp) if kind == "allowlist" else json.load(fp)
+            yield kind, os.path.basename(rel)[:-len(".json")], data
+
+
+def _iter_snapshot_mapping(source):
+    """Yield (kind, name, data) from a JSON file mapping output names to feedstocks."""
+    with open(source, "rb") as fp:
+        mapping = json.load(fp)
+    for name, data in mapping.items():
+        yield "output", name, data
+
+
+def _iter_snapshot(source):
+    if source is None:
+        from .http_utils import get_session
+
+        print("downloading %s" % FEEDSTOCK_OUTPUTS_TARBALL, flush=True)
+        r = get_session().get(FEEDSTOCK_OUTPUTS_TARBALL, stream=True)
+        r.raise_for_status()
+        r.raw.decode_content = True
+        yield from _iter_snapshot_tarball(r.raw)
+    elif os.path.isdir(source):
+        yield from _iter_snapshot_dir(source)
+    elif tarfile.is_tarfile(source):
+        with open(source, "rb") as fp:
+            yield from _iter_snapshot_tarball(fp)
+    else:
+        yield from _iter_snapshot_mapping(source)
+
+
+def build_outputs_index(source, index_path, config=None, allowlist=None):
+    """Build an SQLite index of the feedstock outputs mapping.
+
+    Parameters
+    ----------
+    source : str or None
+        A checkout or tarball of the conda-forge/feedstock-outputs repo, or a
+        JSON file mapping output names to lists of feedstocks. If None, the
+        current tarball of the repo is downloaded.
+    index_path : str
+        Where to write the index. An existing index is replaced atomically.
+    config : dict, optional
+        The `feedstock_outputs_config` to store. It overrides the
+        `config.json` of the snapshot, if any.
+    allowlist : dict, optional
+        The glob patterns of the outputs each feedstock may make. It
+        overrides the `feedstock_outputs_autoreg_allowlist.yml` of the
+        snapshot, if any.
+
+    Returns
+    -------
+    n_outputs : int
+        The number of output names in the index.
+    """
+    dirname = os.path.dirname(os.path.abspath(index_path))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname, suffix=".sqlite.tmp")
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.execute(
+                "CREATE TABLE outputs (name TEXT PRIMARY KEY, feedstocks TEXT NOT NULL) "
+                "WITHOUT ROWID"
+            )
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            snapshot_config = {}
+            snapshot_allowlist = {}
+            n_outputs = 0
+            for kind, name, data in _iter_snapshot(source):
+                if kind == "config":
+                    snapshot_config = data
+                    continue
+                if kind == "allowlist":
+                    snapshot_allowlist = data
+                    continue
+                name, feedstocks = _parse_output(name, data)
+                conn.execute(
+                    "INSERT OR REPLACE INTO outputs VALUES (?, ?)",
+                    (name.lower(), json.dumps(feedstocks)),
+                )
+                n_outputs += 1
+            conn.executemany(
+                "INSERT INTO meta VALUES (?, ?)",
+                [
+                    ("config", json.dumps(config if config is not None else snapshot_config)),
+                    (
+                        "allowlist",
+                        json.dumps(allowlist if allowlist is not None else snapshot_allowlist),
+                    ),
+                    ("built_at", str(time.time())),
+                    ("source", source or FEEDSTOCK_OUTPUTS_TARBALL),
+                ],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp, index_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return n_outputs
+
+
+class FeedstockOutputsIndex:
+    """A read-only, local feedstock outputs index built by `build_outputs_index`.
+
+    Parameters
+    ----------
+    path : str
+        The path to the SQLite index.
+    """
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise RuntimeError("feedstock outputs index %s does not exist!" % path)
+        self.path = path
+        self._conn = sqlite3.connect(
+            "file:%s?mode=ro" % os.path.abspath(path), uri=True, check_same_thread=False
+        )
+        meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+        if "allowlist" not in meta:
+            raise RuntimeError(
+                "feedstock outputs index %s has no autoreg allowlist; rebuild it with "
+                "build_feedstock_outputs_index" % path
+            )
+        self.config = json.loads(meta["config"])
+        self.allowlist = json.loads(meta["allowlist"])
+        self.built_at = float(meta["built_at"])
+        self.source = meta["source"]
+
+    def feedstocks(self, name):
+        """Get the feedstocks allowed to make an output, or None if it is not registered.
+
+        Like `conda_forge_metadata.feedstock_outputs.package_to_feedstock`,
+        these are the feedstocks registered for the (lowercased) name plus
+        those with an allowlist pattern matching the name.
+        """
+        feedstocks = {
+            feedstock
+            for feedstock, patterns in self.allowlist.items()
+            if any(fnmatch(name, pat) for pat in patterns)
+        }
+        row = self._conn.execute(
+            "SELECT feedstocks FROM outputs WHERE name = ?", (name.lower(),)
+        ).fetchone()
+        if row is None and not feedstocks:
+            return None
+        if row is not None:
+            feedstocks.update(json.loads(row[0]))
+        return sorted(feedstocks)
+
+    def sample_names(self, n):
+        """Get up to `n` random registered output names."""
+        return [
+            row[0] for row in self._conn.execute(
+                "SELECT name FROM outputs ORDER BY random() LIMIT ?", (n,)
+            )
+        ]
+
+    def close(self):
+        self._conn.close()
+
+
+def compare_with_online(index, names, max_workers=8):
+    """Time the lookups of `names` in `index` and with the online mapping.
+
+    The online lookups are made in a thread pool, like
+    `feedstock_outputs.get_registered_feedstocks` does.
+
+    Parameters
+    ----------
+    index : FeedstockOutputsIndex
+        The local index.
+    names : list of str
+        The output names to look up.
+    max_workers : int, optional
+        The number of concurrent online lookups.
+
+    Returns
+    -------
+    index_time : float
+        The time in seconds of the index lookups.
+    online_time : float
+        The time in seconds of the online lookups.
+    mismatches : dict
+        Maps the names looked up differently to (index result, online result).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .feedstock_outputs import _LOOKUP_FAILED, _fetch_registered_feedstocks
+
+    t0 = time.monotonic()
+    local = {name: index.feedstocks(name) for name in names}
+    index_time = time.monotonic() - t0
+
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(min(max_workers, len(names)), 1)) as pool:
+        online = dict(zip(names, pool.map(_fetch_registered_feedstocks, names)))
+    online_time = time.monotonic() - t0
+
+    mismatches = {}
+    for name in names:
+        remote = online[name]
+        if remote is _LOOKUP_FAILED:
+            print("could not look up %s online, skipping" % name, flush=True)
+            continue
+        if remote is not None:
+            remote = sorted(set(remote))
+        if local[name] != remote:
+            mismatches[name] = (local[name], remote)
+    return index_time, online_time, mismatches
+
+
+@click.command()
+@click.argument(
+    "source",
+    type=click.Path(exists=True, file_okay=True, dir_okay=True),
+    required=False,
+    default=None,
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(file_okay=True, dir_okay=False),
+    default=None,
+    help="where to write the index (default: %s in the cache directory)" % FEEDSTOCK_OUTPUTS_INDEX_NAME,
+)
+@click.option(
+    "--config",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+    default=None,
+    help="a JSON file with the feedstock outputs config (default: config.json of the snapshot)",
+)
+@click.option(
+    "--allowlist",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+    default=None,
+    help="a YAML file with the autoreg allowlist globs (default: %s of the snapshot)" % AUTOREG_ALLOWLIST,
+)
+@click.option(
+    "--benchmark",
+    type=int,
+    default=0,
+    help="look up this many random outputs in the new index and online, and compare",
+)
+def main(source, output, config, allowlist, benchmark):
+    """Build or refresh a local feedstock outputs index.
+
+    SOURCE is a checkout or tarball of the conda-forge/feedstock-outputs repo
+    or a JSON file mapping output names to feedstocks. If it is not given,
+    the current state of the repo is downloaded.
+    """
+    if output is None:
+        output = default_index_path()
+    if config is not None:
+        with open(config, "rb") as fp:
+            config = json.load(fp)
+    if allowlist is not None:
+        with open(allowlist, "rb") as fp:
+            allowlist = _load_allowlist(fp)
+
+    t0 = time.monotonic()
+    n_outputs = build_outputs_index(source, output, config=config, allowlist=allowlist)
+    print(
+        "indexed %d outputs in %s (%.1fs)" % (n_outputs, output, time.monotonic() - t0),
+        flush=True,
+    )
+
+    if benchmark > 0:
+        index = FeedstockOutputsIndex(output)
+        try:
+            names = index.sample_names(benchmark)
+            index_time, online_time, mismatches = compare_with_online(index, names)
+        finally:
+            index.close()
+        print(
+            "looked up %d outputs: %.3fs with the index, %.1fs online" % (
+                len(names), index_time, online_time
+            ),
+            flush=True,
+        )
+        for name, (local, remote) in sorted(mismatches.items()):
+            print("MISMATCH %s: index %s, online %s" % (name, local, remote), flush=True)
+        if mismatches:
+            raise click.ClickException(
+                "the index disagrees with the online mapping for %d outputs" % len(mismatches)
+            )
@@ -3,14 +3,21 @@
 """
 Fast finish old PR builds on CIs
 
-Using various CI's (CircleCI, Travis CI, and AppVeyor) APIs and information
-about the current build for the relevant CI, this script checks to see if the
-current PR build is the most recent one. It does this by comparing the current
-PR build's build number to other build numbers of builds for this PR. If it is
-not the most recent build for the PR, then this script exits with a failure.
-Thus it can fail the build; stopping it from proceeding further. However, if
-it is the most recent build number or if it is not a PR (e.g. a build on a
-normal branch), then the build proceeds without issues.
+Using various CI's (CircleCI, Travis CI, AppVeyor, Azure Pipelines and GitHub
+Actions) APIs and information about the current build for the relevant CI,
+this script checks to see if the current PR build is the most recent one. It
+does this by comparing the current PR build's build number to other build
+numbers of builds for this PR. If it is not the most recent build for the PR,
+then this script exits with a failure. Thus it can fail the build; stopping it
+from proceeding further. However, if it is the most recent build number or if
+it is not a PR (e.g. a build on a normal branch), then the build proceeds
+without issues.
+
+The build histories are newest first, so they are paged through only until a
+build older than the current one is seen.
+
+The API base URLs can be changed with environment variables (see
+`API_URLS`), e.g. for a GitHub Enterprise server or a local test server.
 """
 
 
@@ -27,28 +34,91 @@ import codecs
 import contextlib
 import json
 import os
+import signal
+import subprocess
 import sys
+import time
 
 try:
+    from urllib.error import HTTPError
+    from urllib.parse import quote
     from urllib.request import (
         Request,
         urlopen,
     )
 except ImportError:
+    from urllib import quote
     from urllib2 import (
+        HTTPError,
         Request,
         urlopen,
     )
 
+# (ETag, data) keyed on URL so that repeated checks use conditional requests
+_ETAG_CACHE = {}
 
-def request_json(url, headers={}):
-    request = Request(url, headers=headers)
-    with contextlib.closing(urlopen(request)) as response:
-        reader = codecs.getreader("utf-8")
-        return json.load(reader(response))
+# (environment variable, default) of the API base URL of each CI; on Azure
+# it is the collection URL of the build
+API_URLS = {
+    "circle": ("FF_CI_CIRCLE_API_URL", "https://circleci.com/api/v1.1"),
+    "travis": ("FF_CI_TRAVIS_API_URL", "https://api.travis-ci.org"),
+    "appveyor": ("FF_CI_APPVEYOR_API_URL", "https://ci.appveyor.com/api"),
+    "azure": ("SYSTEM_COLLECTIONURI", None),
+    "github_actions": ("GITHUB_API_URL", "https://api.github.com"),
+}
+
+
+def api_url(ci, url=None):
+    """Get the API base URL of a CI, without a trailing slash.
+
+    `url` is used if it is given, then the environment variable of the CI
+    in `API_URLS` and then the public API.
+    """
+    if url is None:
+        env, default = API_URLS[ci]
+        url = os.environ.get(env) or default
+    if url is None:
+        raise RuntimeError("the %s API URL is not set (%s)" % (ci, API_URLS[ci][0]))
+    return url.rstrip("/")
 
 
-def circle_check_latest_pr_build(repo, pr, build_num):
+def request_json(url, headers={}):
+    headers = dict(headers)
+    cached = _ETAG_CACHE.get(url)
+    if cached is not None:
+        headers["If-None-Match"] = cached[0]
+
+    # use the pooled session with timeouts when this runs from the package
+    try:
+        from .http_utils import get_session
+    except ImportError:
+        get_session = None
+
+    if get_session is not None:
+        response = get_session().get(url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            return cached[1]
+        response.raise_for_status()
+        data = response.json()
+        etag = response.headers.get("ETag")
+    else:
+        request = Request(url, headers=headers)
+        try:
+            with contextlib.closing(urlopen(request)) as response:
+                reader = codecs.getreader("utf-8")
+                data = json.load(reader(response))
+                etag = response.info().get("ETag")
+        except HTTPError as e:
+            if e.code == 304 and cached is not None:
+                return cached[1]
+            raise
+
+    if etag:
+        _ETAG_CACHE[url] = (etag, data)
+    return data
+
+
+def circle_check_latest_pr_build(repo, pr, build_num, page_size=30, base_url=None):
     # Not a PR so it is latest.
     if pr is None:
         return True
@@ -56,55 +126,114 @@ def circle_check_latest_pr_build(repo, pr, build_num):
     headers = {
         "Accept": "application/json",
     }
-    url = "https://circleci.com/api/v1.1/project/github/{repo}/tree/pull/{pr}"
-
-    builds = request_json(url.format(repo=repo, pr=pr), headers=headers)
+    url = (
+        api_url("circle", base_url)
+        + "/project/github/{repo}/tree/pull/{pr}?limit={limit}&offset={offset}"
+    )
 
-    # Parse the response to get a list of build numbers for this PR.
     job_name = os.environ.get("CIRCLE_JOB")
-    same_param_builds = []
-    for b in builds:
-        b_params = b.get("build_parameters") or {}
-        if b_params.get("CIRCLE_JOB") == job_name:
-            same_param_builds.append(b)
-    pr_build_nums = set(map(lambda b: int(b["build_num"]), same_param_builds))
-    pr_build_nums.add(build_num)
-
-    # Check if our build number is the latest (largest)
-    # out of all of the builds for this PR.
-    if build_num < max(pr_build_nums):
-        return False
-    else:
+    offset = 0
+    while True:
+        builds = request_json(
+            url.format(repo=repo, pr=pr, limit=page_size, offset=offset),
+            headers=headers,
+        )
+
+        # Parse the response to get the build numbers for this job.
+        same_param_builds = []
+        for b in builds:
+            b_params = b.get("build_parameters") or {}
+            if b_params.get("CIRCLE_JOB") == job_name:
+                same_param_builds.append(b)
+        pr_build_nums = set(map(lambda b: int(b["build_num"]), same_param_builds))
+
+        # Check if there is a newer (larger) build number for this PR.
+        if pr_build_nums and build_num < max(pr_build_nums):
+            return False
+
+        # Builds are newest first, so stop once this build is reached.
+        if len(builds) < page_size or any(
+            int(b["build_num"]) <= build_num for b in builds
+        ):
+            return True
+        offset += page_size
+
+
+def travis_check_latest_pr_build(repo, pr, build_num, base_url=None):
+    # Not a PR so it is latest.
+    if pr is None:
         return True
 
-
-def travis_check_latest_pr_build(repo, pr, build_num):
+    headers = {
+        "Accept": "application/vnd.travis-ci.2+json",
+    }
+    url = api_url("travis", base_url) + "/repos/{repo}/builds?event_type=pull_request"
+
+    after_number = None
+    while True:
+        page_url = url.format(repo=repo)
+        if after_number is not None:
+            page_url += "&after_number=%d" % after_number
+        data = request_json(page_url, headers=headers)
+
+        # Parse the response to get a list of build numbers for this PR.
+        builds = data["builds"]
+        pr_builds = filter(lambda b: b["pull_request_number"] == pr, builds)
+        pr_build_nums = set(map(lambda b: int(b["number"]), pr_builds))
+
+        # Check if there is a newer (larger) build number for this PR.
+        if pr_build_nums and build_num < max(pr_build_nums):
+            return False
+
+        # Builds are newest first, so stop once this build is reached.
+        build_nums = [int(b["number"]) for b in builds]
+        if not build_nums or min(build_nums) <= build_num:
+            return True
+        after_number = min(build_nums)
+
+
+def appveyor_check_latest_pr_build(
+    repo, pr, build_num, total_builds=50, page_size=10, base_url=None
+):
     # Not a PR so it is latest.
     if pr is None:
         return True
 
     headers = {
-        "Accept": "application/vnd.travis-ci.2+json",
+        "Accept": "application/json",
     }
-    url = "https://api.travis-ci.org/repos/{repo}/builds?event_type=pull_request"
+    url = (
+        api_url("appveyor", base_url)
+        + "/projects/{repo}/history?recordsNumber={records}"
+    )
 
-    data = request_json(url.format(repo=repo), headers=headers)
+    start_build_id = None
+    n_seen = 0
+    while n_seen < total_builds:
+        page_url = url.format(repo=repo, records=min(page_size, total_builds - n_seen))
+        if start_build_id is not None:
+            page_url += "&startBuildId=%d" % start_build_id
+        data = request_json(page_url, headers=headers)
 
-    # Parse the response to get a list of build numbers for this PR.
-    builds = data["builds"]
-    pr_builds = filter(lambda b: b["pull_request_number"] == pr, builds)
-    pr_build_nums = set(map(lambda b: int(b["number"]), pr_builds))
-    pr_build_nums.add(build_num)
+        # Parse the response to get a list of build numbers for this PR.
+        builds = data["builds"]
+        pr_builds = filter(lambda b: b.get("pullRequestId", "") == str(pr), builds)
+        pr_build_nums = set(map(lambda b: int(b["buildNumber"]), pr_builds))
 
-    # Check if our build number is the latest (largest)
-    # out of all of the builds for this PR.
-    if build_num < max(pr_build_nums):
-        return False
-    else:
-        return True
+        # Check if there is a newer (larger) build number for this PR.
+        if pr_build_nums and build_num < max(pr_build_nums):
+            return False
+
+        # Builds are newest first, so stop once this build is reached.
+        if not builds or any(int(b["buildNumber"]) <= build_num for b in builds):
+            return True
+        n_seen += len(builds)
+        start_build_id = int(builds[-1]["buildId"])
+
+    return True
 
 
-def appveyor_check_latest_pr_build(repo, pr, build_num, total_builds=50):
+def azure_check_latest_pr_build(repo, pr, build_num, page_size=10, base_url=None):
     # Not a PR so it is latest.
     if pr is None:
         return True
@@ -112,24 +241,224 @@ def appveyor_check_latest_pr_build(repo, pr, build_num, total_builds=50):
     headers = {
         "Accept": "application/json",
     }
-    url = "https://ci.appveyor.com/api/projects/{repo}/history?recordsNumber={total_builds}"
+    # the organization, project and pipeline come from the predefined
+    # variables of the build (e.g., https://dev.azure.com/conda-forge/)
+    url = (
+        "{collection}/{project}/_apis/build/builds?definitions={definition}"
+        "&branchName=refs/pull/{pr}/merge&queryOrder=queueTimeDescending"
+        "&$top={top}&api-version=6.0"
+    )
 
-    data = request_json(url.format(repo=repo, total_builds=total_builds), headers=headers)
+    data = request_json(
+        url.format(
+            collection=api_url("azure", base_url),
+            project=quote(os.environ["SYSTEM_TEAMPROJECT"]),
+            definition=os.environ["SYSTEM_DEFINITIONID"],
+            pr=pr,
+            top=page_size,
+        ),
+        headers=headers,
+    )
 
-    # Parse the response to get a list of build numbers for this PR.
-    builds = data["builds"]
-    pr_builds = filter(lambda b: b.get("pullRequestId", "") == str(pr), builds)
-    pr_build_nums = set(map(lambda b: int(b["buildNumber"]), pr_builds))
-    pr_build_nums.add(build_num)
+    # The query only has builds of this pipeline for this PR, newest first,
+    # so a single page is enough.
+    pr_build_nums = set(map(lambda b: int(b["id"]), data["value"]))
 
-    # Check if our build number is the latest (largest)
-    # out of all of the builds for this PR.
-    if build_num < max(pr_build_nums):
+    # Check if there is a newer (larger) build id for this PR.
+    if pr_build_nums and build_num < max(pr_build_nums):
         return False
     else:
         return True
 
 
+def _github_pr_head():
+    """Get the (repo full name, branch) of the PR head from the event payload."""
+    event_path = os.environ.get("GITHUB_EVENT_PATH")
+    if not event_path or not os.path.exists(event_path):
+        return None, None
+    with open(event_path) as fp:
+        head = (json.load(fp).get("pull_request") or {}).get("head") or {}
+    return (head.get("repo") or {}).get("full_name"), head.get("ref")
+
+
+def _github_run_is_for_pr(run, pr, head_repo, head_ref):
+    if run.get("pull_requests"):
+        return pr in [p["number"] for p in run["pull_requests"]]
+    # runs from forks have no pull_requests data, so match the PR head
+    return (
+        head_repo is not None
+        and head_ref is not None
+        and (run.get("head_repository") or {}).get("full_name") == head_repo
+        and run.get("head_branch") == head_ref
+    )
+
+
+def github_actions_check_latest_pr_build(
+    repo, pr, build_num, page_size=30, base_url=None
+):
+    # Not a PR so it is latest.
+    if pr is None:
+        return True
+
+    headers = {
+        "Accept": "application/vnd.github+json",
+    }
+    if os.environ.get("GITHUB_TOKEN"):
+        headers["Authorization"] = "Bearer %s" % os.environ["GITHUB_TOKEN"]
+    url = (
+        api_url("github_actions", base_url)
+        + "/repos/{repo}/actions/runs"
+        "?event=pull_request&per_page={per_page}&page={page}"
+    )
+    head_repo, head_ref = _github_pr_head()
+    if head_ref is None:
+        head_ref = os.environ.get("GITHUB_HEAD_REF") or None
+    if head_ref:
+        url += "&branch=%s" % quote(head_ref, safe="")
+
+    # run numbers only compare within the same workflow
+    workflow = os.environ.get("GITHUB_WORKFLOW")
+    page = 1
+    while True:
+        data = request_json(
+            url.format(repo=repo, per_page=page_size, page=page), headers=headers,
+        )
+
+        runs = data["workflow_runs"]
+        same_workflow_runs = [
+            r for r in runs if workflow is None or r.get("name") == workflow
+        ]
+        pr_runs = filter(
+            lambda r: _github_run_is_for_pr(r, pr, head_repo, head_ref),
+            same_workflow_runs,
+        )
+        pr_build_nums = set(map(lambda r: int(r["run_number"]), pr_runs))
+
+        # Check if there is a newer (larger) run number for this PR.
+        if pr_build_nums and build_num < max(pr_build_nums):
+            return False
+
+        # Runs are newest first, so stop once this run is reached.
+        if len(runs) < page_size or any(
+            int(r["run_number"]) <= build_num for r in same_workflow_runs
+        ):
+            return True
+        page += 1
+
+
+CHECKS = {
+    "circle": circle_check_latest_pr_build,
+    "travis": travis_check_latest_pr_build,
+    "appveyor": appveyor_check_latest_pr_build,
+    "azure": azure_check_latest_pr_build,
+    "github_actions": github_actions_check_latest_pr_build,
+}
+
+
+def _pid_alive(pid):
+    # reap the process if it is our own child, since a zombie takes signals
+    try:
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _group_members(pgid):
+    """List the pids in the process group `pgid` other than this process."""
+    try:
+        out = subprocess.check_output(["ps", "-A", "-o", "pid=", "-o", "pgid="])
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    members = []
+    for line in out.decode("utf-8", "replace").splitlines():
+        fields = line.split()
+        if len(fields) == 2 and int(fields[1]) == pgid and int(fields[0]) != os.getpid():
+            members.append(int(fields[0]))
+    return members
+
+
+def _stop_process_group(pid, grace=30):
+    """Stop the process group of `pid`, escalating to SIGKILL after `grace` seconds."""
+    # the watchdog usually shares the process group of the build
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    try:
+        pgid = os.getpgid(pid)
+        os.killpg(pgid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    deadline = time.monotonic() + grace
+    while time.monotonic() < deadline:
+        if not _pid_alive(pid):
+            return
+        time.sleep(1)
+
+    if pgid != os.getpgrp():
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        return
+    # kill the rest of our own group, but not the watchdog itself
+    for member in set(_group_members(pgid)) | {pid}:
+        try:
+            os.kill(member, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def watch_pr_build(check, repo, pr, build_num, pid, interval=120):
+    """Re-check for a newer PR build while `pid` runs, stopping it if there is one.
+
+    Errors from the CI API are printed and the check is tried again at the
+    next interval. Repeated checks are conditional requests, so they are
+    cheap while nothing changes.
+
+    Returns
+    -------
+    superseded : bool
+        True if the build was stopped for a newer one and False if the
+        process ended on its own.
+    """
+    # Not a PR so it is never superseded.
+    if pr is None:
+        return False
+
+    next_check = time.monotonic() + interval
+    while _pid_alive(pid):
+        if time.monotonic() < next_check:
+            time.sleep(min(1, max(next_check - time.monotonic(), 0)))
+            continue
+        next_check = time.monotonic() + interval
+
+        try:
+            latest = check(repo, pr, build_num)
+        except Exception as e:
+            print("ff_ci_pr_build: check for newer builds failed: %r" % (e,))
+            sys.stdout.flush()
+            continue
+
+        if latest is False:
+            print(
+                "ff_ci_pr_build: a newer build of PR #%s exists; stopping this "
+                "outdated build (build %s, process group of pid %s)." % (
+                    pr, build_num, pid
+                )
+            )
+            sys.stdout.flush()
+            _stop_process_group(pid)
+            return True
+
+    return False
+
+
 def main(*args):
     if not args:
         args = sys.argv[1:]
@@ -146,11 +475,7 @@ def main(*args):
     parser.add_argument(
         "--ci",
         required=True,
-        choices=[
-            "circle",
-            "travis",
-            "appveyor",
-        ],
+        choices=sorted(CHECKS),
         help="Which CI to check for an outdated build",
     )
     parser.add_argument(
@@ -161,7 +486,8 @@ def main(*args):
     parser.add_argument(
         "bld",
         type=int,
-        help="CI build number for this pull request",
+        help="CI build number for this pull request (the build id on Azure and "
+        "the run number on GitHub Actions)",
     )
     parser.add_argument(
         "pr",
@@ -170,7 +496,23 @@ def main(*args):
         help="GitHub pull request number of this build",
     )
 
+    parser.add_argument(
+        "--watch-pid",
+        type=int,
+        default=None,
+        help="Keep checking while this process (e.g. conda-build) runs and stop "
+        "its process group once a newer build of the PR exists",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=120,
+        help="Seconds between checks with --watch-pid (default: 120)",
+    )
+
     params = parser.parse_args(args)
+    if params.watch_pid is not None and not hasattr(os, "killpg"):
+        parser.error("--watch-pid is not supported on this platform")
     verbose = params.verbose
     ci = params.ci
     repo = params.repo
@@ -180,16 +522,17 @@ def main(*args):
     except ValueError:
         pr = None
 
+    if params.watch_pid is not None:
+        if verbose:
+            print("Watching pid %d for a newer build of this PR." % params.watch_pid)
+        return int(watch_pr_build(
+            CHECKS[ci], repo, pr, bld, params.watch_pid, interval=params.interval,
+        ))
+
     if verbose:
         print("Checking to see if this PR build is outdated.")
 
-    exit_code = 0
-    if ci == "circle":
-        exit_code = int(circle_check_latest_pr_build(repo, pr, bld) is False)
-    elif ci == "travis":
-        exit_code = int(travis_check_latest_pr_build(repo, pr, bld) is False)
-    elif ci == "appveyor":
-        exit_code = int(appveyor_check_latest_pr_build(repo, pr, bld) is False)
+    exit_code = int(CHECKS[ci](repo, pr, bld) is False)
 
     if verbose and exit_code == 1:
         print("Failing outdated PR build to end it.")
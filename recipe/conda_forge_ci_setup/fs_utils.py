@@ -0,0 +1,110 @@
+import contextlib
+import json
+import os
+import stat
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+
+
+@contextlib.contextmanager
+def file_lock(pth):
+    """Hold an exclusive, process-wide lock on `pth` (created if missing)."""
+    os.makedirs(os.path.dirname(os.path.abspath(pth)), exist_ok=True)
+    with open(pth, "a+b") as fp:
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        else:
+            fp.seek(0)
+            # LK_LOCK gives up after 10 attempts, so wait as long as it takes
+            while True:
+                try:
+                    msvcrt.locking(fp.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+            else:
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_json(pth, default=None):
+    """Read a JSON file, returning `default` if it is missing or corrupt."""
+    try:
+        with open(pth) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return default
+
+
+def _read_umask():
+    # os.umask can only be read by setting it, so this is done once at import
+    # rather than while other threads may be creating files
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+_UMASK = _read_umask()
+
+
+def write_text_atomic(pth, text):
+    """Write `text` to `pth` so that readers never see a partial file.
+
+    The file keeps its mode if it exists and otherwise gets the mode of a
+    file created with `open` (not the 0600 of `tempfile.mkstemp`).
+    """
+    dn = os.path.dirname(os.path.abspath(pth))
+    os.makedirs(dn, exist_ok=True)
+    try:
+        mode = stat.S_IMODE(os.stat(pth).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    fd, tmp = tempfile.mkstemp(dir=dn, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w") as fp:
+            fp.write(text)
+        os.chmod(tmp, mode)
+        os.replace(tmp, pth)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+def write_json_atomic(pth, data):
+    """Write `data` as JSON to `pth` so that readers never see a partial file."""
+    write_text_atomic(pth, json.dumps(data, indent=2, sort_keys=True))
+
+
+def stat_key(pth):
+    """Identify a version of a file by its size, mtime and inode."""
+    st = os.stat(pth)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "inode": st.st_ino}
+
+
+def get_cache_dir(*parts):
+    """Get (and create) a directory in the per-host cache of this package.
+
+    The location can be set with `CONDA_FORGE_CI_SETUP_CACHE_DIR` and
+    otherwise follows `XDG_CACHE_HOME`.
+    """
+    root = os.environ.get("CONDA_FORGE_CI_SETUP_CACHE_DIR")
+    if not root:
+        root = os.path.join(
+            os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+            "conda-forge-ci-setup",
+        )
+    pth = os.path.join(root, *parts)
+    os.makedirs(pth, exist_ok=True)
+    return pth
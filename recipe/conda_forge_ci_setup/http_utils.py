@@ -0,0 +1,99 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts in seconds for requests that do not set one
+DEFAULT_TIMEOUT = (10, 60)
+
+# keep-alive connections kept per host
+DEFAULT_POOL_MAXSIZE = 10
+
+# statuses retried with backoff, honoring Retry-After when it is sent
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """An `HTTPAdapter` that applies a default timeout to every request."""
+
+    def __init__(self, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+def _make_retry(total):
+    # only idempotent methods are retried on a bad status, but connection
+    # errors are retried for every method since nothing was sent
+    return Retry(
+        total=total,
+        backoff_factor=1,
+        status_forcelist=RETRY_STATUSES,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def configure_session(
+    session, pool_maxsize=DEFAULT_POOL_MAXSIZE, timeout=DEFAULT_TIMEOUT, retries=3
+):
+    """Set up pooled connections, default timeouts and retries on a session.
+
+    This is used for the shared session and for the sessions of other
+    clients (e.g., `binstar_client`) so that all of the network calls behave
+    the same way.
+
+    Parameters
+    ----------
+    session : requests.Session
+        The session to configure.
+    pool_maxsize : int, optional
+        The number of keep-alive connections kept per host.
+    timeout : float or tuple, optional
+        The default (connect, read) timeout.
+    retries : int, optional
+        The number of retries for connection errors and retryable statuses.
+
+    Returns
+    -------
+    session : requests.Session
+        The same session.
+    """
+    adapter = TimeoutHTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=pool_maxsize,
+        max_retries=_make_retry(retries),
+        timeout=timeout,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # gzip/deflate plus br/zstd when their decoders are installed
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    return session
+
+
+def get_session():
+    """Get the process-wide session shared by all of the network calls."""
+    global _SESSION
+
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                _SESSION = configure_session(requests.Session())
+    return _SESSION
+
+
+def get_json(url, headers=None, **kwargs):
+    """GET a URL with the shared session and return the decoded JSON body."""
+    r = get_session().get(url, headers=headers, **kwargs)
+    r.raise_for_status()
+    return r.json()
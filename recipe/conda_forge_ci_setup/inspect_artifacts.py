@@ -1,16 +1,103 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import click
-import conda_build.config
-from conda_package_handling.api import list_contents
 
+from .fs_utils import read_json, write_json_atomic
 from .utils import (
     built_distributions,
     built_distributions_from_recipe_variant,
-    compute_sha256sum,
     human_readable_bytes,
 )
 
+INSPECT_REPORT_NAME = "inspect_artifacts.json"
+
+# listings of the artifacts keyed on their sha256, next to the subdirs
+LISTING_CACHE_DIR = ".artifact_listings"
+
+
+def _listing_cache_path(artifact, sha256, full):
+    return os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(artifact))),
+        LISTING_CACHE_DIR,
+        "%s%s.json" % (sha256, ".full" if full else ""),
+    )
+
+
+def inspect_artifact(artifact, full=False):
+    """Hash and list one artifact with a single read of the file.
+
+    Cached digests are reused, and computed ones are stored in the cache
+    along with the file count. The listing is cached by the sha256 of the
+    artifact, so an unchanged artifact is not read again. The payload of
+    `.conda` artifacts is only decompressed if `full` is True.
+
+    Returns
+    -------
+    report : dict
+        The size, sha256, md5, index and files of the artifact.
+    """
+    from .artifact_contents import list_artifact
+    from .digests import (
+        DEFAULT_ALGORITHMS,
+        get_cached_artifact_digests,
+        record_artifact_digests,
+        record_artifact_file_count,
+    )
+
+    cached = get_cached_artifact_digests(artifact)
+    listing = None
+    if cached is not None:
+        listing = read_json(_listing_cache_path(artifact, cached["sha256"], full))
+
+    if listing is not None:
+        digests = cached
+        files, index = listing["files"], listing["index"]
+    else:
+        files, digests, index = list_artifact(
+            artifact, algorithms=() if cached is not None else DEFAULT_ALGORITHMS, full=full,
+        )
+        if cached is not None:
+            digests = cached
+            record_artifact_file_count(artifact, len(files))
+        else:
+            record_artifact_digests(artifact, digests, n_files=len(files))
+        write_json_atomic(
+            _listing_cache_path(artifact, digests["sha256"], full),
+            {"files": files, "index": index},
+        )
+
+    return {
+        "size": os.path.getsize(artifact),
+        "sha256": digests["sha256"],
+        "md5": digests["md5"],
+        "n_files": len(files),
+        "index": index,
+        "files": files,
+    }
+
+
+def inspect_artifacts(distributions, jobs=None, full=False):
+    """Inspect several artifacts concurrently.
+
+    Returns
+    -------
+    reports : dict
+        The output of `inspect_artifact` keyed on path.
+    """
+    distributions = sorted(distributions)
+    if not distributions:
+        return {}
+    if jobs is None:
+        jobs = min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(distributions)))) as exe:
+        return dict(zip(
+            distributions,
+            exe.map(lambda artifact: inspect_artifact(artifact, full=full), distributions),
+        ))
+
 
 @click.command()
 @click.option(
@@ -32,19 +119,143 @@ from .utils import (
     default=(),
     help="path to conda_build_config.yaml defining your base matrix",
 )
-def main(all_packages, recipe_dir, variant):
+@click.option(
+    '--jobs',
+    '-j',
+    default=None,
+    type=click.IntRange(min=1),
+    envvar='CF_INSPECT_JOBS',
+    help="the number of artifacts to inspect at once (default: the number of CPUs, at most 8)",
+)
+@click.option(
+    '--json',
+    'write_json',
+    is_flag=True,
+    help="write a report of all artifacts to %s in the conda-build root directory" % INSPECT_REPORT_NAME,
+)
+@click.option(
+    '--full-scan',
+    is_flag=True,
+    help="decompress the whole payload of .conda artifacts instead of using info/paths.json",
+)
+@click.option(
+    '--baseline',
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+    default=None,
+    envvar='CF_ARTIFACT_BASELINE',
+    help="an artifact manifest of a previous build to compare the sizes and file counts against",
+)
+@click.option(
+    '--max-size-growth',
+    type=float,
+    default=10.0,
+    show_default=True,
+    help="the allowed growth of the compressed and total sizes over the baseline in percent",
+)
+@click.option(
+    '--max-file-count-growth',
+    type=float,
+    default=10.0,
+    show_default=True,
+    help="the allowed growth of the file count over the baseline in percent",
+)
+@click.option(
+    '--fail-on-growth',
+    is_flag=True,
+    help="fail instead of warning when the growth over the baseline is too large",
+)
+@click.option(
+    '--top-files',
+    type=click.IntRange(min=0),
+    default=10,
+    show_default=True,
+    help="the number of largest files to record per artifact in the manifest",
+)
+@click.option(
+    '--find-duplicates',
+    is_flag=True,
+    help="report the file contents shipped by more than one artifact",
+)
+@click.option(
+    '--min-duplicate-size',
+    type=click.IntRange(min=1),
+    default=1024,
+    show_default=True,
+    help="the smallest file size in bytes to consider with --find-duplicates",
+)
+def main(
+    all_packages, recipe_dir, variant, jobs, write_json, full_scan, baseline,
+    max_size_growth, max_file_count_growth, fail_on_growth, top_files,
+    find_duplicates, min_duplicate_size,
+):
+    import conda_build.config
+
+    from .artifact_contents import format_file_record
+
     if all_packages:
         distributions = built_distributions()
     else:
         distributions = built_distributions_from_recipe_variant(recipe_dir=recipe_dir, variant=variant)
 
-    for artifact in sorted(distributions):
-        path = Path(artifact)
-        relpath = path.relative_to(conda_build.config.croot)
+    reports = inspect_artifacts(distributions, jobs=jobs, full=full_scan)
+
+    for artifact, report in reports.items():
+        relpath = Path(artifact).relative_to(conda_build.config.croot)
         print("-" * len(str(relpath)))
         print(relpath)
         print("-" * len(str(relpath)))
-        print("-- Size:", human_readable_bytes(path.stat().st_size))
-        print("-- SHA256:", compute_sha256sum(path))
+        print("-- Size:", human_readable_bytes(report["size"]))
+        print("-- SHA256:", report["sha256"])
         print("-- Contents:")
-        list_contents(artifact, verbose=True)
+        for record in report["files"]:
+            print(format_file_record(record))
+
+    duplicates = None
+    if find_duplicates:
+        from .artifact_duplicates import find_duplicate_content, print_duplicate_content
+
+        print("-" * 23)
+        print("Duplicated file content")
+        print("-" * 23)
+        duplicates = find_duplicate_content(reports, min_size=min_duplicate_size)
+        print_duplicate_content(duplicates, conda_build.config.croot)
+
+    if write_json:
+        report_path = os.path.join(conda_build.config.croot, INSPECT_REPORT_NAME)
+        json_report = {
+            "artifacts": {
+                Path(artifact).relative_to(conda_build.config.croot).as_posix(): report
+                for artifact, report in reports.items()
+            },
+        }
+        if duplicates is not None:
+            for pair in duplicates:
+                pair["outputs"] = [
+                    Path(o).relative_to(conda_build.config.croot).as_posix()
+                    for o in pair["outputs"]
+                ]
+            json_report["duplicates"] = duplicates
+        write_json_atomic(report_path, json_report)
+        print("Wrote the artifact report to", report_path)
+
+    from .artifact_manifest import (
+        ARTIFACT_MANIFEST_NAME,
+        build_manifest,
+        compare_manifests,
+        read_baseline,
+    )
+
+    manifest = build_manifest(reports, conda_build.config.croot, top_n=top_files)
+    manifest_path = os.path.join(conda_build.config.croot, ARTIFACT_MANIFEST_NAME)
+    write_json_atomic(manifest_path, manifest)
+    print("Wrote the artifact manifest to", manifest_path)
+
+    if baseline is not None:
+        print("Comparing the artifacts against the baseline", baseline)
+        violations = compare_manifests(
+            manifest, read_baseline(baseline), max_size_growth, max_file_count_growth,
+        )
+        for msg in violations:
+            print("%s: %s" % ("ERROR" if fail_on_growth else "WARNING", msg))
+        if violations and fail_on_growth:
+            sys.exit(1)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+Print shell assignments for values from a CI support YAML file
+
+This reads the file once in a single process, instead of starting a new
+interpreter for every `shyaml get-value` call in the build setup scripts.
+Keys are dotted paths where integers index into lists (e.g.
+`cuda_compiler_version.0`), like `shyaml get-value`. If the file or the key
+does not exist, the default is used. The output is meant to be `eval`-ed:
+
+    eval "$(query_ci_config .ci_support/${CONFIG}.yaml \\
+        --get CUDA_VERSION cuda_compiler_version.0 None)"
+"""
+
+import argparse
+import os
+import shlex
+import sys
+
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+import yaml
+
+_MISSING = object()
+
+
+def get_value(data, key):
+    """Get the value at a dotted `key` path, or `_MISSING` if it does not exist."""
+    value = data
+    for part in key.split("."):
+        if isinstance(value, dict):
+            if part not in value:
+                return _MISSING
+            value = value[part]
+        elif isinstance(value, list):
+            try:
+                value = value[int(part)]
+            except (ValueError, IndexError):
+                return _MISSING
+        else:
+            return _MISSING
+    return value
+
+
+def format_value(value):
+    if isinstance(value, (dict, list)):
+        return yaml.safe_dump(value, default_flow_style=False).rstrip("\n")
+    return str(value)
+
+
+def main(*args):
+    if not args:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0],
+    )
+    parser.add_argument(
+        "config_file",
+        type=str,
+        help="the YAML file to read (e.g., .ci_support/${CONFIG}.yaml)",
+    )
+    parser.add_argument(
+        "--get",
+        nargs=3,
+        action="append",
+        default=[],
+        metavar=("VAR", "KEY", "DEFAULT"),
+        help="assign the value of KEY (or DEFAULT if missing) to the shell variable VAR",
+    )
+    parser.add_argument(
+        "--no-export",
+        action="store_true",
+        help="print plain assignments instead of `export` statements",
+    )
+    params = parser.parse_args(args)
+
+    data = None
+    if os.path.exists(params.config_file):
+        with open(params.config_file, "rb") as f:
+            data = yaml.load(f, Loader=_SafeLoader)
+
+    prefix = "" if params.no_export else "export "
+    for var, key, default in params.get:
+        if not var.isidentifier():
+            parser.error("invalid shell variable name: %s" % var)
+        value = _MISSING if data is None else get_value(data, key)
+        if value is _MISSING:
+            value = default
+        print("%s%s=%s" % (prefix, var, shlex.quote(format_value(value))))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import time
+
+from .fs_utils import file_lock, get_cache_dir, read_json, write_json_atomic
+
+# the entries are small JSON files, so this holds thousands of renders
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+_STATS = {"hits": 0, "misses": 0}
+
+
+def _render_cache_dir():
+    return get_cache_dir("render")
+
+
+def _max_bytes():
+    return int(
+        os.environ.get("CONDA_FORGE_CI_SETUP_RENDER_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)
+    )
+
+
+def _update_hash_with_file(h, pth):
+    with open(pth, "rb") as fp:
+        h.update(hashlib.sha256(fp.read()).digest())
+
+
+def compute_render_cache_key(recipe_dir, variant_files, clobber_file, *extra):
+    """Compute a content hash of everything a recipe render depends on.
+
+    Parameters
+    ----------
+    recipe_dir : str
+        The recipe directory. Every file in it is hashed.
+    variant_files : list of str
+        The variant config files passed to the render.
+    clobber_file : str or None
+        The `clobber_*.yaml` file, if any.
+    *extra : str
+        Any other values the render depends on (e.g., build tool versions).
+
+    Returns
+    -------
+    key : str
+        The hex digest identifying the render.
+    """
+    h = hashlib.sha256()
+    for value in extra:
+        h.update(("extra:%s\0" % value).encode("utf-8"))
+
+    for root, dirs, files in os.walk(recipe_dir):
+        dirs.sort()
+        for fname in sorted(files):
+            pth = os.path.join(root, fname)
+            h.update(("recipe:%s\0" % os.path.relpath(pth, recipe_dir)).encode("utf-8"))
+            _update_hash_with_file(h, pth)
+
+    for pth in variant_files:
+        h.update(b"variant\0")
+        _update_hash_with_file(h, pth)
+
+    if clobber_file is not None:
+        h.update(b"clobber\0")
+        _update_hash_with_file(h, clobber_file)
+
+    return h.hexdigest()
+
+
+def _record(stat):
+    _STATS[stat] += 1
+    stats_path = os.path.join(_render_cache_dir(), "stats.json")
+    with file_lock(stats_path + ".lock"):
+        stats = read_json(stats_path, default={"hits": 0, "misses": 0})
+        stats[stat] = stats.get(stat, 0) + 1
+        write_json_atomic(stats_path, stats)
+    return stats
+
+
+def _evict(cache_dir, max_bytes):
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".render.json"):
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    # least recently used first, since hits touch the entry
+    for _, size, pth in sorted(entries):
+        if total <= max_bytes:
+            break
+        for p in (pth, pth + ".lock"):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+        total -= size
+
+
+def cached_render(key, render_func):
+    """Return the cached result of `render_func` for `key`, rendering on a miss.
+
+    Entries are stored per host, locked per key so that concurrent jobs
+    rendering the same recipe wait for each other instead of racing, and
+    evicted least-recently-used first once the cache exceeds its size cap.
+    Only a miss takes the lock, and waiting for it has no time limit, even
+    on Windows, since a render can take a minute.
+
+    Parameters
+    ----------
+    key : str
+        The output of `compute_render_cache_key`.
+    render_func : callable
+        A function returning a JSON-serializable dict.
+
+    Returns
+    -------
+    result : dict
+        The (possibly cached) output of `render_func`.
+    """
+    cache_dir = _render_cache_dir()
+    pth = os.path.join(cache_dir, key + ".render.json")
+
+    # entries are written atomically, so hits do not need the lock
+    result = read_json(pth)
+    if result is None:
+        with file_lock(pth + ".lock"):
+            # another job may have rendered it while we waited
+            result = read_json(pth)
+            hit = result is not None
+            if not hit:
+                result = render_func()
+                write_json_atomic(pth, result)
+    else:
+        hit = True
+    if hit:
+        now = time.time()
+        os.utime(pth, (now, now))
+    stats = _record("hits" if hit else "misses")
+
+    print(
+        "render cache %s for %s (this process: %d hits, %d misses; "
+        "host total: %d hits, %d misses)" % (
+            "hit" if hit else "miss",
+            key[:12],
+            _STATS["hits"],
+            _STATS["misses"],
+            stats.get("hits", 0),
+            stats.get("misses", 0),
+        ),
+        flush=True,
+    )
+
+    with file_lock(os.path.join(cache_dir, ".evict.lock")):
+        _evict(cache_dir, _max_bytes())
+
+    return result
@@ -0,0 +1,159 @@
+import io
+import os
+import time
+
+from .utils import human_readable_bytes
+
+
+class UploadMetrics:
+    """Timing of one streamed upload.
+
+    The read times are those of the last pass over the file, which is the
+    one sending it.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.bytes_sent = 0
+        self.start = time.monotonic()
+        self.first_read = None
+        self.last_read = None
+        self.end = None
+
+    def rewind(self):
+        self.bytes_sent = 0
+        self.first_read = None
+        self.last_read = None
+
+    def record_read(self, n):
+        if n:
+            now = time.monotonic()
+            if self.first_read is None:
+                self.first_read = now
+            self.last_read = now
+            self.bytes_sent += n
+
+    @property
+    def time_to_first_read(self):
+        """The time until the file started to be sent (hashing and staging included)."""
+        return None if self.first_read is None else self.first_read - self.start
+
+    @property
+    def time_after_last_read(self):
+        """The time from the end of the file to the end of the upload."""
+        if self.last_read is None or self.end is None:
+            return None
+        return self.end - self.last_read
+
+    @property
+    def total_time(self):
+        return (self.end or time.monotonic()) - self.start
+
+    @property
+    def bytes_per_second(self):
+        if self.first_read is None or self.last_read is None:
+            return None
+        return self.bytes_sent / max(self.last_read - self.first_read, 1e-6)
+
+    def report(self, basename):
+        rate = self.bytes_per_second
+        first = self.time_to_first_read
+        after = self.time_after_last_read
+        return (
+            "Uploaded {}: {} in {:.1f}s ({}/s, sending started after {}, "
+            "server done {} after the last byte)".format(
+                basename,
+                human_readable_bytes(self.bytes_sent),
+                self.total_time,
+                "n/a" if rate is None else human_readable_bytes(rate),
+                "n/a" if first is None else "%.2fs" % first,
+                "n/a" if after is None else "%.2fs" % after,
+            )
+        )
+
+
+class MeteredFile(io.FileIO):
+    """A read-only file recording in `metrics` how it is read.
+
+    anaconda-client reads the file to hash it before sending it and seeks
+    back to the start after each pass, so the metrics are reset whenever the
+    file is rewound and only the last pass (the upload) is recorded.
+
+    Parameters
+    ----------
+    path : str
+        The path to the file.
+    metrics : UploadMetrics
+        Updated as the file is read.
+    """
+
+    def __init__(self, path, metrics):
+        super().__init__(path, "rb")
+        self.metrics = metrics
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        pos = super().seek(offset, whence)
+        if pos == 0:
+            self.metrics.rewind()
+        return pos
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.metrics.record_read(len(chunk or b""))
+        return chunk
+
+    def readinto(self, b):
+        n = super().readinto(b)
+        self.metrics.record_read(n or 0)
+        return n
+
+
+def stream_upload(
+    cli,
+    owner,
+    package_name,
+    version,
+    basename,
+    path,
+    distribution_type="conda",
+    description="",
+    dependencies=None,
+    attrs=None,
+    channels=("main",),
+):
+    """Upload a file to anaconda.org with `Binstar.upload` and log its throughput.
+
+    anaconda-client streams the multipart body from the file, so only a
+    chunk of it is in memory at a time.
+
+    Parameters
+    ----------
+    cli : binstar_client.Binstar
+        The authenticated client.
+    owner, package_name, version, basename : str
+        Where to upload the file (the basename includes the subdir).
+    path : str
+        The path to the file.
+
+    Returns
+    -------
+    metrics : UploadMetrics
+        The timing of the upload.
+    """
+    metrics = UploadMetrics(os.path.getsize(path))
+    with MeteredFile(path, metrics) as fp:
+        cli.upload(
+            owner,
+            package_name,
+            version,
+            basename,
+            fp,
+            distribution_type,
+            description,
+            dependencies=dependencies,
+            attrs=attrs,
+            channels=list(channels),
+        )
+    metrics.end = time.monotonic()
+    print(metrics.report(basename), flush=True)
+    return metrics
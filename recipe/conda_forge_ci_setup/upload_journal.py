@@ -0,0 +1,56 @@
+import os
+
+from .fs_utils import file_lock, read_json, stat_key, write_json_atomic
+
+# sidecar file kept in conda-build's root workspace (build_artifacts)
+UPLOAD_JOURNAL_NAME = ".upload_journal.json"
+
+# the distribution already exists on the owner/channel
+CHECKED = "checked"
+# the distribution was uploaded to the owner/channel
+UPLOADED = "uploaded"
+# the distribution was copied (or already exists) in production
+COPIED = "copied"
+
+
+class UploadJournal:
+    """The persistent per-artifact progress of uploads to one owner/channel.
+
+    A retry of `upload_or_check`, or a rerun of the CI job on the same build
+    artifacts, uses the journal to skip the artifacts that are done. Entries
+    are tied to the (size, mtime_ns, inode) of the artifact so that a rebuilt
+    artifact is never skipped.
+
+    Parameters
+    ----------
+    croot : str
+        The conda-build root workspace holding the artifacts.
+    owner : str
+        The anaconda.org owner uploaded to.
+    channel : str
+        The anaconda.org label uploaded to.
+    """
+
+    def __init__(self, croot, owner, channel):
+        self.path = os.path.join(croot, UPLOAD_JOURNAL_NAME)
+        self.scope = "%s/%s" % (owner, channel)
+
+    def state(self, dist):
+        """Get the state of a distribution, or None if it has no valid entry."""
+        entry = (read_json(self.path, default={}).get(self.scope) or {}).get(
+            os.path.abspath(dist)
+        )
+        if entry is None or entry.get("stat") != stat_key(dist):
+            return None
+        return entry["state"]
+
+    def mark(self, dists, state):
+        """Record the state of one or more distributions."""
+        if isinstance(dists, str):
+            dists = [dists]
+        with file_lock(self.path + ".lock"):
+            journal = read_json(self.path, default={})
+            scoped = journal.setdefault(self.scope, {})
+            for dist in dists:
+                scoped[os.path.abspath(dist)] = {"state": state, "stat": stat_key(dist)}
+            write_json_atomic(self.path, journal)
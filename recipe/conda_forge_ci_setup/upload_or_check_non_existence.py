@@ -1,37 +1,32 @@
 #!/usr/bin/env python
 from __future__ import print_function
 
-import contextlib
 import os
-import shutil
-import subprocess
 import click
-import tempfile
+import random
+import threading
 import time
-
-from binstar_client.utils import get_server_api
-import binstar_client.errors
-from conda.base.context import context
-import conda_build.api
-import conda_build.config
+from concurrent.futures import ThreadPoolExecutor
 
 from .feedstock_outputs import request_copy, split_pkg
-from .utils import determine_build_tool, get_built_distribution_names_and_subdirs
+from .streaming_upload import stream_upload
+from .upload_journal import CHECKED, COPIED, UPLOADED, UploadJournal
+from .utils import (
+    ArtifactIndex,
+    determine_build_tool,
+    get_built_distribution_names_and_subdirs,
+)
 
-conda_subdir = context.subdir
+# the overall time to wait for distributions on staging to be copied by
+# another build before deleting and re-uploading them
+STAGING_WAIT_DEADLINE = 150
 
+# the number of copy requests to the validation server in flight at once
+MAX_CONCURRENT_COPIES = 2
 
-@contextlib.contextmanager
-def get_temp_token(token):
-    dn = tempfile.mkdtemp()
-    fn = os.path.join(dn, "binstar.token")
-    with open(fn, "w") as fh:
-        fh.write(token)
-    yield fn
-    try:
-        shutil.rmtree(dn)
-    except Exception:
-        print(f"Failed to remove temporary directroy '{dn}'")
+_PENDING = "pending"
+_ON_STAGING = "on_staging"
+_IN_PROD = "in_prod"
 
 
 def built_distribution_already_exists(cli, name, version, fname, owner, channel):
@@ -62,6 +57,8 @@ def built_distribution_already_exists(cli, name, version, fname, owner, channel)
     bool
         Whether the distribution already exists on the binstar account.
     """
+    import binstar_client.errors
+
     folder, basename = os.path.split(fname)
     _, platform = os.path.split(folder)
 
@@ -97,29 +94,359 @@ def built_distribution_already_exists(cli, name, version, fname, owner, channel)
     return exists
 
 
-def upload(token_fn, path, owner, channels, private_upload=False, force_metadata_update=True):
-    cmd = ['anaconda', '--quiet', '--show-traceback', '-t', token_fn,
-           'upload', path, '--user={}'.format(owner),
-           '--channel={}'.format(channels)]
-    if private_upload:
-        cmd.append("--private")
-    if force_metadata_update:
-        cmd.append("--force-metadata-update")
-    subprocess.check_call(cmd,  env=os.environ)
+def _configure_session(cli, jobs):
+    """Keep enough pooled keep-alive connections for all concurrent uploads."""
+    from .http_utils import DEFAULT_POOL_MAXSIZE, configure_session
+
+    configure_session(cli.session, pool_maxsize=max(jobs, DEFAULT_POOL_MAXSIZE))
+
+
+def upload(cli, path, owner, channels, private_upload=False, force_metadata_update=True):
+    """Upload a distribution with the live binstar client.
+
+    This does the same as `anaconda upload --user=<owner> --channel=<channels>
+    [--private] [--force-metadata-update] <path>`, without starting a new
+    process and TLS session for each distribution. The file is streamed from
+    disk and the throughput is logged.
+    """
+    from binstar_client import errors
+    from binstar_client.inspect_package.conda import inspect_conda_package
+
+    with open(path, "rb") as fd:
+        package_attrs, release_attrs, file_attrs = inspect_conda_package(path, fd)
+    name = package_attrs["name"]
+    version = release_attrs["version"]
+
+    try:
+        # anaconda-client>=1.12 takes the enum and uses its value
+        from binstar_client.utils.config import PackageType
+        package_type = PackageType.CONDA
+    except ImportError:
+        package_type = "conda"
+
+    try:
+        cli.package(owner, name)
+    except errors.NotFound:
+        cli.add_package(
+            owner,
+            name,
+            package_attrs.get("summary"),
+            package_attrs.get("license"),
+            public=not private_upload,
+            attrs=package_attrs,
+            license_url=package_attrs.get("license_url"),
+            license_family=package_attrs.get("license_family"),
+            package_type=package_type,
+        )
+    else:
+        if force_metadata_update:
+            cli.update_package(owner, name, package_attrs)
+
+    try:
+        cli.release(owner, name, version)
+    except errors.NotFound:
+        cli.add_release(owner, name, version, [], None, release_attrs)
+    else:
+        if force_metadata_update:
+            cli.update_release(owner, name, version, release_attrs)
+
+    print("Uploading {} to {} with label {}".format(path, owner, channels), flush=True)
+    stream_upload(
+        cli,
+        owner,
+        name,
+        version,
+        file_attrs["basename"],
+        path,
+        distribution_type="conda",
+        description=file_attrs.get("description") or "",
+        dependencies=file_attrs.get("dependencies"),
+        attrs=file_attrs["attrs"],
+        channels=[channels],
+    )
 
 
-def delete_dist(token_fn, path, owner, channels):
+def delete_dist(cli, path, owner, channels):
     parts = path.split(os.sep)
     path = os.path.join(parts[-2], parts[-1])
     _, name, ver, _ = split_pkg(path)
-    subprocess.check_call(
-        [
-            'anaconda', '--quiet', '-t', token_fn,
-            'remove', '-f', '%s/%s/%s/%s/%s' % (
-                owner, name, ver, parts[-2], parts[-1]),
-        ],
-        env=os.environ
-    )
+    cli.remove_dist(owner, name, ver, basename="%s/%s" % (parts[-2], parts[-1]))
+
+
+def list_built_distributions(croot, subdirs, names):
+    """List the (name, version, path) of the built distributions, largest first.
+
+    Starting the largest uploads first keeps the slowest one from being
+    left for the end.
+    """
+    index = ArtifactIndex(croot, subdirs)
+    return [
+        (rec.name, rec.version, rec.path)
+        for rec in sorted(index.select(names=names), key=lambda rec: rec.size, reverse=True)
+    ]
+
+
+def schedule_uploads(built_distributions, upload_func, jobs=1, n_tries=3):
+    """Run `upload_func(name, version, path)` for each built distribution.
+
+    At most `jobs` distributions are processed at once, in the given order
+    (largest first from `upload_or_check`) so that the long uploads start
+    early. Each distribution is retried with a backoff before its error is
+    raised.
+
+    Parameters
+    ----------
+    built_distributions : list of tuple
+        The (name, version, path) tuples to process.
+    upload_func : callable
+        The function processing one distribution.
+    jobs : int, optional
+        The maximum number of concurrent uploads.
+    n_tries : int, optional
+        The number of attempts per distribution.
+
+    Returns
+    -------
+    results : list
+        The return values of `upload_func` in the order of `built_distributions`.
+    """
+    def _run(dist):
+        for i in range(n_tries):
+            try:
+                return upload_func(*dist)
+            except Exception as e:
+                if i == n_tries - 1:
+                    raise
+                timeout = 5 * 2 ** i
+                print(
+                    "Failed to upload {} due to {}. Trying again in {} seconds".format(
+                        dist[2], e, timeout),
+                    flush=True,
+                )
+                time.sleep(timeout)
+
+    if jobs <= 1 or len(built_distributions) <= 1:
+        return [_run(dist) for dist in built_distributions]
+
+    with ThreadPoolExecutor(max_workers=jobs) as exe:
+        futures = [exe.submit(_run, dist) for dist in built_distributions]
+        return [fut.result() for fut in futures]
+
+
+class CopyPipeline:
+    """Request copies to production in batches while the uploads continue.
+
+    Distributions are added as soon as they are on staging. Every
+    `batch_size` of them are sent to the copy endpoint in the background, so
+    promotion does not wait for the slowest upload.
+
+    Parameters
+    ----------
+    feedstock : str
+        The feedstock name.
+    channel : str
+        The label to copy to.
+    journal : UploadJournal
+        Records the distributions that were copied.
+    batch_size : int
+        The number of distributions per copy request.
+    git_sha, comment_on_error
+        Passed to `request_copy`. Only one copy request at a time is sent
+        with `comment_on_error`, and none once one of them failed, so a
+        failing attempt comments at most once.
+    """
+
+    def __init__(
+        self, feedstock, channel, journal, batch_size, git_sha=None, comment_on_error=True,
+    ):
+        self.feedstock = feedstock
+        self.channel = channel
+        self.journal = journal
+        self.batch_size = batch_size
+        self.git_sha = git_sha
+        self.comment_on_error = comment_on_error
+        self.results = {}
+        self.staged = []
+        self._comment_taken = False
+        self._batch = []
+        self._futures = []
+        self._lock = threading.Lock()
+        self._exe = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_COPIES)
+
+    def _copy(self, batch):
+        with self._lock:
+            comment_on_error = self.comment_on_error and not self._comment_taken
+            if comment_on_error:
+                self._comment_taken = True
+
+        results = {}
+        ok = request_copy(
+            self.feedstock,
+            batch,
+            self.channel,
+            git_sha=self.git_sha,
+            comment_on_error=comment_on_error,
+            artifact_results=results,
+        )
+        if ok and comment_on_error:
+            # nothing was commented, so a later request may comment
+            with self._lock:
+                self._comment_taken = False
+        copied = [path for path in batch if results.get(path)]
+        if copied:
+            self.journal.mark(copied, COPIED)
+        return results
+
+    def _submit(self):
+        # call with the lock held
+        if self._batch:
+            print("Requesting copy of {} distribution(s): {}".format(
+                len(self._batch), ", ".join(self._batch)), flush=True)
+            self._futures.append((self._batch, self._exe.submit(self._copy, self._batch)))
+            self._batch = []
+
+    def add(self, path):
+        """Add a distribution that is on staging."""
+        with self._lock:
+            self.staged.append(path)
+            self._batch.append(path)
+            if len(self._batch) >= self.batch_size:
+                self._submit()
+
+    def close(self):
+        """Send the last batch and wait for all of the copies.
+
+        Returns
+        -------
+        results : dict
+            True or False for each distribution added, keyed on path. The
+            distributions of a failed copy request are False.
+        """
+        with self._lock:
+            self._submit()
+        try:
+            for batch, fut in self._futures:
+                try:
+                    results = fut.result()
+                except Exception as e:
+                    print("ERROR copy request failed: {}".format(repr(e)), flush=True)
+                    results = {}
+                self.results.update({path: bool(results.get(path)) for path in batch})
+        finally:
+            self._exe.shutdown()
+        for path in sorted(self.results):
+            print("copy of {}: {}".format(
+                path, "ok" if self.results[path] else "FAILED"), flush=True)
+        return self.results
+
+
+def upload_to_staging(
+    cli,
+    built_distributions,
+    owner,
+    prod_owner,
+    channel,
+    journal,
+    jobs=1,
+    wait_deadline=STAGING_WAIT_DEADLINE,
+    on_staged=None,
+):
+    """Upload distributions to the staging owner, waiting out stale copies there.
+
+    A distribution still on staging is usually being copied to production by
+    an earlier build. All such distributions are polled together, with a
+    jittered backoff, until a single overall deadline. The ones still stuck
+    on staging then are deleted and re-uploaded together, so the worst-case
+    wall time tracks the slowest distribution rather than their sum.
+
+    If `on_staged` is given, it is called with the path of each distribution
+    as soon as it is on staging and needs a copy to production.
+
+    Returns
+    -------
+    to_copy_paths : list of str
+        The paths of the distributions that need a copy to production.
+    """
+    def _staged(path):
+        if on_staged is not None:
+            on_staged(path)
+        return _ON_STAGING
+
+    def _resume(name, version, path):
+        state = journal.state(path)
+        if state == COPIED:
+            print("Distribution {} was already copied to {}.".format(
+                path, prod_owner), flush=True)
+            return _IN_PROD
+        if state == UPLOADED:
+            if built_distribution_already_exists(
+                cli, name, version, path, prod_owner, channel,
+            ):
+                journal.mark(path, COPIED)
+                return _IN_PROD
+            if built_distribution_already_exists(
+                cli, name, version, path, owner, channel,
+            ):
+                print("Distribution {} was already uploaded to {}.".format(
+                    path, owner), flush=True)
+                return _staged(path)
+        return _PENDING
+
+    def _check_and_upload(name, version, path):
+        if built_distribution_already_exists(
+            cli, name, version, path, prod_owner, channel,
+        ):
+            # package already in production
+            journal.mark(path, COPIED)
+            return _IN_PROD
+        elif not built_distribution_already_exists(
+            cli, name, version, path, owner, channel,
+        ):
+            upload(cli, path, owner, channel)
+            journal.mark(path, UPLOADED)
+            return _staged(path)
+        return _PENDING
+
+    def _delete_and_reupload(name, version, path):
+        print(
+            "WARNING: Distribution {} already existed in "
+            "{} for a while. Deleting and "
+            "re-uploading.".format(path, owner)
+        )
+        delete_dist(cli, path, owner, channel)
+        upload(cli, path, owner, channel)
+        journal.mark(path, UPLOADED)
+        return _staged(path)
+
+    states = dict(zip(
+        built_distributions, schedule_uploads(built_distributions, _resume, jobs=jobs)
+    ))
+
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        pending = [dist for dist in built_distributions if states[dist] == _PENDING]
+        if not pending:
+            break
+        if attempt > 0:
+            remaining = wait_deadline - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            delay = min(15 * attempt * random.uniform(0.8, 1.2), remaining)
+            print(
+                "{} distribution(s) already exist on {}. Waiting another {:.0f} "
+                "seconds to try uploading again: {}".format(
+                    len(pending), owner, delay, ", ".join(path for _, _, path in pending)),
+                flush=True,
+            )
+            time.sleep(delay)
+        states.update(zip(pending, schedule_uploads(pending, _check_and_upload, jobs=jobs)))
+        attempt += 1
+
+    stuck = [dist for dist in built_distributions if states[dist] == _PENDING]
+    states.update(zip(stuck, schedule_uploads(stuck, _delete_and_reupload, jobs=jobs)))
+
+    return [dist[2] for dist in built_distributions if states[dist] == _ON_STAGING]
 
 
 def upload_or_check(
@@ -134,7 +461,13 @@ def upload_or_check(
     prod_owner="conda-forge",
     comment_on_error=True,
     feedstock_root=None,
+    jobs=1,
+    copy_batch_size=0,
 ):
+    from binstar_client.utils import get_server_api
+    from conda.base.context import context
+    import conda_build.config
+
     if validate and "STAGING_BINSTAR_TOKEN" in os.environ:
         token = os.environ["STAGING_BINSTAR_TOKEN"]
         print("Using STAGING_BINSTAR_TOKEN for anaconda.org uploads to %s." % owner)
@@ -148,6 +481,7 @@ def upload_or_check(
         token = None
 
     cli = get_server_api(token=token)
+    _configure_session(cli, jobs)
 
     build_tool = determine_build_tool(feedstock_root)
 
@@ -155,85 +489,68 @@ def upload_or_check(
         recipe_dir=recipe_dir, variant=variant, build_tool=build_tool
     )
 
-    # The list of built distributions
-    paths = set()
-    for subdir in list(allowed_subdirs) + [conda_subdir, 'noarch']:
-        if not os.path.exists(os.path.join(conda_build.config.croot, subdir)):
-            continue
-        for p in os.listdir(os.path.join(conda_build.config.croot, subdir)):
-            paths.add(os.path.join(subdir, p))
-
-    built_distributions = [
-        (
-            split_pkg(path)[1],
-            split_pkg(path)[2],
-            os.path.join(conda_build.config.croot, path)
-        )
-        # TODO: flip this over to .conda when that format
-        #  is in flight
-        for path in paths if (path.endswith('.tar.bz2') or path.endswith(".conda"))
-        if split_pkg(path)[1] in allowed_dist_names
-    ]
+    built_distributions = list_built_distributions(
+        conda_build.config.croot,
+        list(allowed_subdirs) + [context.subdir, 'noarch'],
+        allowed_dist_names,
+    )
 
-    # This is the actual fix where we create the token file once and reuse it
-    # for all uploads
+    # All uploads go through the one authenticated client
     if token:
-        with get_temp_token(cli.token) as token_fn:
-            if validate:
-                to_copy_paths = []
-                for name, version, path in built_distributions:
-                    need_copy = True
-                    for i in range(0, 5):
-                        time.sleep(i*15)
-                        if built_distribution_already_exists(
-                            cli, name, version, path, prod_owner, channel,
-                        ):
-                            # package already in production
-                            need_copy = False
-                            break
-                        elif not built_distribution_already_exists(
-                            cli, name, version, path, owner, channel,
-                        ):
-                            upload(token_fn, path, owner, channel)
-                            break
-                        else:
-                            print(
-                                "Distribution {} already exists on {}. "
-                                "Waiting another {} seconds to "
-                                "try uploading again.".format(path, owner, (i+1) * 15))
-                    else:
-                        print(
-                            "WARNING: Distribution {} already existed in "
-                            "{} for a while. Deleting and "
-                            "re-uploading.".format(path, owner)
-                        )
-                        delete_dist(token_fn, path, owner, channel)
-                        upload(token_fn, path, owner, channel)
-
-                    if need_copy:
-                        to_copy_paths.append(path)
-
-                if to_copy_paths and not request_copy(
-                    feedstock,
-                    to_copy_paths,
-                    channel,
-                    git_sha=git_sha,
-                    comment_on_error=comment_on_error,
-                ):
-                    raise RuntimeError(
-                        "copy from staging to production channel failed")
-                else:
-                    return True
+        # the progress is persisted so that retries only redo unfinished work
+        journal = UploadJournal(conda_build.config.croot, owner, channel)
+        if validate and copy_batch_size > 0:
+            # copies are requested in batches while the uploads continue
+            pipeline = CopyPipeline(
+                feedstock, channel, journal, copy_batch_size,
+                git_sha=git_sha, comment_on_error=comment_on_error,
+            )
+            try:
+                upload_to_staging(
+                    cli, built_distributions, owner, prod_owner, channel, journal,
+                    jobs=jobs, on_staged=pipeline.add,
+                )
+            finally:
+                results = pipeline.close()
+            if not all(results.get(path, False) for path in pipeline.staged):
+                raise RuntimeError(
+                    "copy from staging to production channel failed")
+            return True
+        elif validate:
+            to_copy_paths = upload_to_staging(
+                cli, built_distributions, owner, prod_owner, channel, journal, jobs=jobs,
+            )
+
+            if to_copy_paths and not request_copy(
+                feedstock,
+                to_copy_paths,
+                channel,
+                git_sha=git_sha,
+                comment_on_error=comment_on_error,
+            ):
+                raise RuntimeError(
+                    "copy from staging to production channel failed")
             else:
-                for name, version, path in built_distributions:
-                    if not built_distribution_already_exists(
-                        cli, name, version, path, owner, channel,
-                    ):
-                        upload(token_fn, path, owner, channel, private_upload=private_upload)
-                    else:
-                        print(
-                            'Distribution {} already exists for {}'.format(path, owner))
+                if to_copy_paths:
+                    journal.mark(to_copy_paths, COPIED)
                 return True
+        else:
+            def _upload(name, version, path):
+                if journal.state(path) in (CHECKED, UPLOADED):
+                    print(
+                        'Distribution {} was already handled for {}'.format(path, owner))
+                elif not built_distribution_already_exists(
+                    cli, name, version, path, owner, channel,
+                ):
+                    upload(cli, path, owner, channel, private_upload=private_upload)
+                    journal.mark(path, UPLOADED)
+                else:
+                    print(
+                        'Distribution {} already exists for {}'.format(path, owner))
+                    journal.mark(path, CHECKED)
+
+            schedule_uploads(built_distributions, _upload, jobs=jobs)
+            return True
     else:
         for name, version, path in built_distributions:
             if not built_distribution_already_exists(cli, name, version, path, owner, channel):
@@ -256,6 +573,8 @@ def retry_upload_or_check(
     git_sha=None,
     private_upload=False,
     feedstock_root=None,
+    jobs=1,
+    copy_batch_size=0,
 ):
     # perform a backoff in case we fail.  THis should limit the failures from
     # issues with the Anaconda api
@@ -268,6 +587,8 @@ def retry_upload_or_check(
                 comment_on_error=True if i == n_try-1 else False,
                 private_upload=private_upload,
                 feedstock_root=feedstock_root,
+                jobs=jobs,
+                copy_batch_size=copy_batch_size,
             )
             return res
         except Exception as e:
@@ -295,12 +616,17 @@ def retry_upload_or_check(
               default=None,
               type=click.Path(exists=True, file_okay=False, dir_okay=True),
               help="path to feedstock")
-def main(recipe_dir, owner, channel, variant, feedstock_root):
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1),
+              envvar='CF_UPLOAD_JOBS', show_default=True,
+              help="the maximum number of concurrent uploads")
+def main(recipe_dir, owner, channel, variant, feedstock_root, jobs):
     """
     Upload or check consistency of a built version of a conda recipe with binstar.
     Note: The existence of the BINSTAR_TOKEN environment variable determines
     whether the upload should actually take place."""
-    return retry_upload_or_check(None, recipe_dir, owner, channel, variant, feedstock_root=feedstock_root)
+    return retry_upload_or_check(
+        None, recipe_dir, owner, channel, variant, feedstock_root=feedstock_root, jobs=jobs,
+    )
 
 
 if __name__ == '__main__':
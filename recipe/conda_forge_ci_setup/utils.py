@@ -1,27 +1,33 @@
-import hashlib
 import os
 
-import conda_build.api
-import conda_build.config
-from conda.base.context import context
-from conda_build.variants import combine_specs, parse_config_file
-import joblib
-
 try:
     from ruamel_yaml import safe_load
 except ImportError:
     from yaml import safe_load
 
-import rattler_build_conda_compat.render
+# conda, conda-build and rattler-build-conda-compat are slow to import, so
+# they are imported in the functions that need them to keep the startup
+# of the console scripts fast
+
+from .digests import compute_digests
+from .feedstock_config import get_feedstock_config
+from .render_cache import cached_render, compute_render_cache_key
 
 CONDA_BUILD = "conda-build"
 RATTLER_BUILD = "rattler-build"
 
-os.makedirs(".joblib_cache", exist_ok=True)
-JOBLIB_MEMORY = joblib.Memory(".joblib_cache", verbose=0)
+
+def _build_tool_version(build_tool):
+    if build_tool == RATTLER_BUILD:
+        from importlib.metadata import version
+
+        return "rattler-build-conda-compat=" + version("rattler-build-conda-compat")
+
+    import conda_build
+
+    return "conda-build=" + conda_build.__version__
 
 
-@JOBLIB_MEMORY.cache
 def get_built_distribution_names_and_subdirs(recipe_dir=None, variant=None, build_tool=None):
     feedstock_root = os.environ.get(
         "FEEDSTOCK_ROOT",
@@ -42,17 +48,52 @@ def get_built_distribution_names_and_subdirs(recipe_dir=None, variant=None, buil
                 )
             ]
 
-    additional_config = {}
+    variant = list(variant)
+
+    clobber_file = None
     for v in variant:
         variant_dir, base_name = os.path.split(v)
-        clobber_file = os.path.join(variant_dir, 'clobber_' + base_name)
-        if os.path.exists(clobber_file):
-            additional_config = {
-                'clobber_sections_file': clobber_file
-            }
+        if os.path.exists(os.path.join(variant_dir, 'clobber_' + base_name)):
+            clobber_file = os.path.join(variant_dir, 'clobber_' + base_name)
             break
 
+    # the render is keyed on the content of all of its inputs so that the
+    # cache is never stale when the recipe or the configs change
+    key = compute_render_cache_key(
+        recipe_dir,
+        variant,
+        clobber_file,
+        build_tool,
+        _build_tool_version(build_tool),
+    )
+    result = cached_render(
+        key,
+        lambda: _render_built_distribution_names_and_subdirs(
+            recipe_dir, variant, build_tool, clobber_file
+        ),
+    )
+
+    # Print the skipped distributions
+    for name in result["skipped"]:
+        print("{} configuration was skipped in build/skip.".format(name))
+
+    return set(result["names"]), set(result["subdirs"])
+
+
+def _render_built_distribution_names_and_subdirs(recipe_dir, variant, build_tool, clobber_file):
+    import conda_build.api
+    import conda_build.config
+
+    additional_config = {}
+    if clobber_file is not None:
+        additional_config = {
+            'clobber_sections_file': clobber_file
+        }
+
     if build_tool == RATTLER_BUILD:
+        from conda_build.variants import combine_specs, parse_config_file
+        import rattler_build_conda_compat.render
+
         # some conda-build magic here
         with open(variant[-1]) as f:
             final_variant = safe_load(f)
@@ -90,47 +131,122 @@ def get_built_distribution_names_and_subdirs(recipe_dir=None, variant=None, buil
             **additional_config
         )
 
-    # Print the skipped distributions
-    skipped_distributions = [m for m, _, _ in metas if m.skip()]
-    for m in skipped_distributions:
-        print("{} configuration was skipped in build/skip.".format(m.name()))
-
     subdirs = set([m.config.target_subdir for m, _, _ in metas if not m.skip()])
     subdirs |= set(["noarch"])  # always include noarch
-    return set([m.name() for m, _, _ in metas if not m.skip()]), subdirs
+    return {
+        "names": sorted(set([m.name() for m, _, _ in metas if not m.skip()])),
+        "subdirs": sorted(subdirs),
+        "skipped": [m.name() for m, _, _ in metas if m.skip()],
+    }
+
+
+DIST_EXTENSIONS = (".tar.bz2", ".conda")
+
+
+class DistRecord:
+    """A built conda artifact in conda-build's root workspace."""
+
+    __slots__ = ("subdir", "name", "version", "build", "ext", "size", "mtime", "path")
+
+    def __init__(self, subdir, name, version, build, ext, size, mtime, path):
+        self.subdir = subdir
+        self.name = name
+        self.version = version
+        self.build = build
+        self.ext = ext
+        self.size = size
+        self.mtime = mtime
+        self.path = path
+
+    @property
+    def fn(self):
+        return "%s-%s-%s%s" % (self.name, self.version, self.build, self.ext)
+
+    def __repr__(self):
+        return "DistRecord(%s/%s)" % (self.subdir, self.fn)
+
+
+class ArtifactIndex:
+    """An index of the conda artifacts in some subdirs of conda-build's root workspace.
+
+    The subdirs are scanned once with `os.scandir`, keeping the stat results,
+    and every file name is parsed once. Files whose names are not
+    `name-version-build.ext` are skipped with a warning.
+
+    Parameters
+    ----------
+    croot : str
+        The conda-build root workspace.
+    subdirs : iterable of str
+        The subdirs to scan. Missing subdirs are skipped.
+    """
+
+    def __init__(self, croot, subdirs):
+        self.croot = croot
+        self.records = []
+        self.by_name = {}
+        self.by_subdir = {}
+
+        for subdir in dict.fromkeys(subdirs):
+            try:
+                entries = os.scandir(os.path.join(croot, subdir))
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    for ext in DIST_EXTENSIONS:
+                        if entry.name.endswith(ext):
+                            break
+                    else:
+                        continue
+                    try:
+                        name_ver, build = entry.name[:-len(ext)].rsplit('-', 1)
+                        name, ver = name_ver.rsplit('-', 1)
+                    except ValueError:
+                        print("could not parse dist name, skipping: %s" % entry.path, flush=True)
+                        continue
+                    st = entry.stat()
+                    self._add(DistRecord(
+                        subdir, name, ver, build, ext, st.st_size, st.st_mtime, entry.path,
+                    ))
+
+    def _add(self, rec):
+        self.records.append(rec)
+        self.by_name.setdefault(rec.name, []).append(rec)
+        self.by_subdir.setdefault(rec.subdir, []).append(rec)
+
+    def select(self, names=None):
+        """Get the records, optionally only those with one of the given names."""
+        if names is None:
+            return list(self.records)
+        return [rec for name in names for rec in self.by_name.get(name, ())]
 
 
 def built_distributions(subdirs=()):
     "List conda artifacts in conda-build's root workspace"
+    import conda_build.config
+    from conda.base.context import context
+
     if not subdirs:
         subdirs = context.subdir, "noarch"
-    paths = []
     for subdir in subdirs:
         subdir_path = os.path.join(conda_build.config.croot, subdir)
         # Workaround for https://github.com/conda-forge/conda-forge-ci-setup-feedstock/issues/394
         if not os.path.exists(subdir_path):
             os.makedirs(subdir_path)
-        for path in os.listdir(subdir_path):
-            if path.endswith((".tar.bz2", ".conda")):
-                paths.append(os.path.join(subdir_path, path))
-    return paths
+    return [rec.path for rec in ArtifactIndex(conda_build.config.croot, subdirs).records]
 
 
 def built_distributions_from_recipe_variant(recipe_dir=None, variant=None, build_tool=None):
-    def _dist_name(dist):
-        return split_pkg(os.path.relpath(dist, conda_build.config.croot))[1]
+    import conda_build.config
 
     allowed_dist_names, allowed_subdirs = get_built_distribution_names_and_subdirs(
         recipe_dir=recipe_dir,
         variant=variant,
         build_tool=build_tool,
     )
-    return [
-        dist
-        for dist in built_distributions(subdirs=allowed_subdirs)
-        if _dist_name(dist) in allowed_dist_names
-    ]
-
+    index = ArtifactIndex(conda_build.config.croot, allowed_subdirs)
+    return [rec.path for rec in index.select(names=allowed_dist_names)]
 
 
 def split_pkg(pkg):
@@ -147,15 +263,8 @@ def split_pkg(pkg):
 
 
 def compute_sha256sum(pth):
-    h = hashlib.sha256()
-
-    with open(pth, 'rb') as fp:
-        chunk = 0
-        while chunk != b'':
-            chunk = fp.read(1024)
-            h.update(chunk)
+    return compute_digests(pth, algorithms=("sha256",))["sha256"]
 
-    return h.hexdigest()
 
 def human_readable_bytes(number):
     for unit in ['bytes', 'KB', 'MB', 'GB', 'TB']:
@@ -168,21 +277,12 @@ def human_readable_bytes(number):
 def determine_build_tool(feedstock_root):
     build_tool = CONDA_BUILD
 
-    if feedstock_root and os.path.exists(os.path.join(feedstock_root, "conda-forge.yml")):
-        with open(os.path.join(feedstock_root, "conda-forge.yml")) as f:
-            conda_forge_config = safe_load(f)
-
-            if conda_forge_config.get("conda_build_tool", CONDA_BUILD) == RATTLER_BUILD:
-                build_tool = RATTLER_BUILD
+    if get_feedstock_config(feedstock_root).conda_build_tool == RATTLER_BUILD:
+        build_tool = RATTLER_BUILD
 
     return build_tool
 
 
 def is_conda_forge_output_validation_on():
     feedstock_root = os.environ.get("FEEDSTOCK_ROOT", os.getcwd())
-    ison = False
-    if os.path.exists(os.path.join(feedstock_root, "conda-forge.yml")):
-        with open(os.path.join(feedstock_root, "conda-forge.yml")) as f:
-            conda_forge_config = safe_load(f)
-            ison = conda_forge_config.get("conda_forge_output_validation", False)
-    return ison
+    return get_feedstock_config(feedstock_root).output_validation
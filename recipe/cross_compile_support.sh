@@ -1,13 +1,25 @@
 #!/bin/bash
 
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
-BUILD_PLATFORM=${BUILD_PLATFORM:-$(conda info --json | jq -r .platform)}
+
+# conda is only queried once; the snapshot is shared with the setup scripts
+if [[ ! -f "${CONDA_ENV_PROBE_FILE:-}" ]]; then
+    if [[ -n "${CONDA_BLD_PATH:-}" ]]; then
+        export CONDA_ENV_PROBE_FILE="${CONDA_BLD_PATH}/conda_env_probe.json"
+    else
+        # do not create a build_artifacts directory wherever this is sourced
+        export CONDA_ENV_PROBE_FILE="$(mktemp -t conda_env_probe.XXXXXX)"
+    fi
+    conda_env_probe --output "${CONDA_ENV_PROBE_FILE}"
+fi
+BUILD_PLATFORM=${BUILD_PLATFORM:-$(jq -r .platform "${CONDA_ENV_PROBE_FILE}")}
 
 if [ -f ${CI_SUPPORT}/${CONFIG}.yaml ]; then
-    HOST_PLATFORM=$(cat ${CI_SUPPORT}/${CONFIG}.yaml | shyaml get-value host_platform.0 None)
-    TARGET_PLATFORM=$(cat ${CI_SUPPORT}/${CONFIG}.yaml | shyaml get-value target_platform.0 None)
-    CUDA_COMPILER_VERSION=$(cat ${CI_SUPPORT}/${CONFIG}.yaml | shyaml get-value cuda_compiler_version.0 None)
-    MICROARCH_LEVEL_NEEDED=$(cat ${CI_SUPPORT}/${CONFIG}.yaml | shyaml get-value microarch_level.0 1)
+    eval "$(query_ci_config --no-export ${CI_SUPPORT}/${CONFIG}.yaml \
+        --get HOST_PLATFORM host_platform.0 None \
+        --get TARGET_PLATFORM target_platform.0 None \
+        --get CUDA_COMPILER_VERSION cuda_compiler_version.0 None \
+        --get MICROARCH_LEVEL_NEEDED microarch_level.0 1)"
     if [ "${HOST_PLATFORM}" = "None" ]; then
       if [ "${TARGET_PLATFORM}" = "None" ]; then
         TARGET_PLATFORM=${BUILD_PLATFORM}
@@ -29,7 +41,7 @@ fi
 # docker image with linux-anvil-x86_64:alma9 image, we use
 # glibc=2.28 for QEMU while still building the package for
 # glib=2.17
-DOCKER_GLIBC_VERSION=$(conda info --json | jq -r '.virtual_pkgs[] | select(.[0] == "__glibc")[1]')
+DOCKER_GLIBC_VERSION=$(jq -r '.virtual_packages[] | select(.name == "__glibc") | .version' "${CONDA_ENV_PROBE_FILE}")
 GLIBC_VERSION=${DOCKER_GLIBC_VERSION:-2.17}
 
 CUDA_COMPILER_VERSION=${CUDA_COMPILER_VERSION:-None}
@@ -2,15 +2,16 @@ set -e
 
 # We don't change the default here to a newer SDK to ensure that old, non-rerendered feedstock keep working.
 if [ -f ${CI_SUPPORT}/${CONFIG}.yaml ]; then
-   export MACOSX_DEPLOYMENT_TARGET=$(cat ${CI_SUPPORT}/${CONFIG}.yaml | shyaml get-value MACOSX_DEPLOYMENT_TARGET.0 10.9)
+   eval "$(query_ci_config ${CI_SUPPORT}/${CONFIG}.yaml \
+       --get MACOSX_DEPLOYMENT_TARGET MACOSX_DEPLOYMENT_TARGET.0 10.9 \
+       --get MACOSX_SDK_VERSION MACOSX_SDK_VERSION.0 0 \
+       --get WITH_LATEST_OSX_SDK WITH_LATEST_OSX_SDK.0 0)"
 fi
 
 export MACOSX_DEPLOYMENT_TARGET=${MACOSX_DEPLOYMENT_TARGET:-10.9}
 
 # Some project require a new SDK version even though they can target older versions
 if [ -f ${CI_SUPPORT}/${CONFIG}.yaml ]; then
-    export MACOSX_SDK_VERSION=$(cat ${CI_SUPPORT}/${CONFIG}.yaml | shyaml get-value MACOSX_SDK_VERSION.0 0)
-    export WITH_LATEST_OSX_SDK=$(cat ${CI_SUPPORT}/${CONFIG}.yaml | shyaml get-value WITH_LATEST_OSX_SDK.0 0)
     if [[ "${WITH_LATEST_OSX_SDK}" != "0" ]]; then
         echo "Setting WITH_LATEST_OSX_SDK is removed. Use MACOSX_SDK_VERSION to specify an explicit version for the SDK."
         export MACOSX_SDK_VERSION=10.15
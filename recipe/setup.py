@@ -42,6 +42,9 @@ setup(
             "mangle_homebrew = conda_forge_ci_setup.mangle_homebrew:main",
             "validate_recipe_outputs = conda_forge_ci_setup.feedstock_outputs:main",  # noqa
             "inspect_artifacts = conda_forge_ci_setup.inspect_artifacts:main",
+            "query_ci_config = conda_forge_ci_setup.query_ci_config:main",
+            "conda_env_probe = conda_forge_ci_setup.conda_env_probe:main",
+            "build_feedstock_outputs_index = conda_forge_ci_setup.feedstock_outputs_index:main",  # noqa
         ]
     },
 )
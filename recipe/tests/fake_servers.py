@@ -0,0 +1,262 @@
+"""Local stand-ins for the HTTP services used by the upload commands."""
+import base64
+import hashlib
+import io
+import itertools
+import json
+import os
+import tarfile
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+def make_artifact(croot, subdir, name, version, build, payload_size=0):
+    """Write a minimal `.tar.bz2` conda package and return its path."""
+    index = {
+        "name": name,
+        "version": version,
+        "build": build,
+        "build_number": 0,
+        "subdir": subdir,
+        "depends": [],
+        "license": "BSD-3-Clause",
+    }
+    if subdir == "noarch":
+        index["noarch"] = "generic"
+    os.makedirs(os.path.join(croot, subdir), exist_ok=True)
+    pth = os.path.join(croot, subdir, "%s-%s-%s.tar.bz2" % (name, version, build))
+    with tarfile.open(pth, "w:bz2") as tar:
+        for fname, data in [
+            ("info/index.json", json.dumps(index).encode("utf-8")),
+            ("info/about.json", json.dumps({"summary": name}).encode("utf-8")),
+            # random bytes do not compress, so the artifact is about this large
+            ("payload.bin", os.urandom(payload_size)),
+        ]:
+            info = tarfile.TarInfo(fname)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return pth
+
+
+def _read_body(handler):
+    if handler.headers.get("Transfer-Encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int(handler.rfile.readline().split(b";")[0].strip(), 16)
+            if size == 0:
+                # skip the trailers
+                while handler.rfile.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            chunks.append(handler.rfile.read(size))
+            handler.rfile.readline()
+        return b"".join(chunks), True
+    length = int(handler.headers.get("Content-Length") or 0)
+    return handler.rfile.read(length), False
+
+
+def _make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # the headers and body are separate writes
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _dispatch(self):
+            body, chunked = _read_body(self)
+            url = urlsplit(self.path)
+            path = unquote(url.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            with service.lock:
+                service.requests.append((self.command, path))
+                service.in_flight += 1
+                service.max_in_flight = max(service.max_in_flight, service.in_flight)
+            try:
+                if service.latency:
+                    threading.Event().wait(service.latency)
+                status, data, *extra_headers = service.handle(
+                    self.command, path, query, self.headers, body, chunked
+                )
+            finally:
+                with service.lock:
+                    service.in_flight -= 1
+            if data is None:
+                data, content_type = b"", None
+            elif isinstance(data, bytes):
+                content_type = "application/xml"
+            else:
+                data = json.dumps(data).encode("utf-8")
+                content_type = "application/json"
+            self.send_response(status)
+            for key, value in (extra_headers[0] if extra_headers else {}).items():
+                self.send_header(key, value)
+            if content_type is not None:
+                self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = _dispatch
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class FakeHTTPService:
+    """An HTTP server on localhost answering with `handle`, used as a context manager.
+
+    `handle` gets the method, the unquoted path, the query parameters, the
+    headers and the body of a request and returns its status, its body (a
+    JSON object, bytes or None) and optionally a dict of extra headers.
+
+    Parameters
+    ----------
+    latency : float, optional
+        The time in seconds each request waits before it is answered.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._server = _Server(("127.0.0.1", 0), _make_handler(self))
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self._server.server_address[1]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def handle(self, method, path, query, headers, body, chunked):
+        raise NotImplementedError
+
+
+class FakeAnacondaOrg(FakeHTTPService):
+    """The parts of the anaconda.org API used to upload conda packages.
+
+    Uploads follow the stage, S3 form POST and commit steps of
+    `binstar_client.Binstar.upload`, with the S3 bucket served here too.
+    `s3_failures` maps a basename to the number of its S3 POSTs to fail.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency=latency)
+        self.packages = set()
+        self.releases = set()
+        self.dists = {}
+        self.s3_failures = {}
+        self.s3_bodies = []
+        self.commits = []
+        self._staged = {}
+        self._ids = itertools.count()
+
+    def client(self):
+        from binstar_client import Binstar
+
+        return Binstar(token="test-token", domain=self.url)
+
+    def add_dist(self, owner, name, version, basename, labels=("main",)):
+        self.packages.add((owner, name))
+        self.releases.add((owner, name, version))
+        self.dists[(owner, name, version, basename)] = {
+            "basename": basename, "labels": list(labels),
+        }
+
+    def handle(self, method, path, query, headers, body, chunked):
+        kind, _, rest = path.lstrip("/").partition("/")
+        with self.lock:
+            if kind == "dist":
+                owner, name, version, basename = rest.split("/", 3)
+                key = (owner, name, version, basename)
+                if method == "DELETE":
+                    return (200, self.dists.pop(key)) if key in self.dists else (404, {})
+                return (200, self.dists[key]) if key in self.dists else (404, {})
+            if kind == "package":
+                key = tuple(rest.split("/"))
+                if method == "POST":
+                    self.packages.add(key)
+                return (200, {}) if key in self.packages else (404, {})
+            if kind == "release":
+                key = tuple(rest.split("/"))
+                if method == "POST":
+                    self.releases.add(key)
+                return (200, {}) if key in self.releases else (404, {})
+            if kind == "stage":
+                dist_id = "dist%d" % next(self._ids)
+                self._staged[dist_id] = (tuple(rest.split("/", 3)), json.loads(body))
+                return 200, {
+                    "post_url": "%s/s3/%s" % (self.url, dist_id),
+                    "form_data": {"key": dist_id},
+                    "dist_id": dist_id,
+                }
+            if kind == "commit":
+                owner, name, version, basename = key = tuple(rest.split("/", 3))
+                staged_key, payload = self._staged[json.loads(body)["dist_id"]]
+                assert staged_key == key
+                self.dists[key] = {"basename": basename, "labels": payload["channels"]}
+                self.commits.append((owner, basename))
+                return 200, {}
+        if kind == "s3":
+            return self._handle_s3(rest, headers, body, chunked)
+        return 404, {}
+
+    def _handle_s3(self, dist_id, headers, body, chunked):
+        message = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + headers["Content-Type"].encode("ascii") + b"\r\n\r\n" + body
+        )
+        fields = {
+            part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+            for part in message.iter_parts()
+        }
+        with self.lock:
+            (_, _, _, basename), _ = self._staged[dist_id]
+            self.s3_bodies.append((basename, len(body), chunked))
+            if self.s3_failures.get(basename):
+                self.s3_failures[basename] -= 1
+                return 500, b"<Error><Code>InternalError</Code></Error>"
+        data = fields["file"]
+        md5 = base64.b64encode(hashlib.md5(data).digest())
+        if fields["Content-MD5"].strip() != md5 or int(fields["Content-Length"]) != len(data):
+            return 400, b"<Error><Code>InvalidDigest</Code></Error>"
+        return 201, b"<PostResponse/>"
+
+
+class FakeValidationServer(FakeHTTPService):
+    """The copy endpoint of the conda-forge validation server.
+
+    `fail` is a set of dists (`subdir/basename`) whose copy requests fail
+    with a server error.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency=latency)
+        self.fail = set()
+        self.copy_requests = []
+
+    def handle(self, method, path, query, headers, body, chunked):
+        if method != "POST" or path != "/feedstock-outputs/copy":
+            return 404, {}
+        data = json.loads(body)
+        with self.lock:
+            self.copy_requests.append(data)
+        if self.fail & set(data["outputs"]):
+            return 500, {"error": "copy failed"}
+        return 200, {"copied": {dist: True for dist in data["outputs"]}}
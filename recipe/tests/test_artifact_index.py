@@ -0,0 +1,26 @@
+from conda_forge_ci_setup.utils import ArtifactIndex
+
+
+def test_artifact_index_skips_unparsable_names(tmp_path, capsys):
+    for subdir, fname in [
+        ("noarch", "foo-1.0-py_0.conda"),
+        ("noarch", "foo-1.0-py_0.tar.bz2"),
+        ("noarch", "notapackage.conda"),
+        ("noarch", "bar-1.tar.bz2"),
+        ("noarch", "README.md"),
+        ("linux-64", "bar-2.1-h1234567_3.conda"),
+    ]:
+        (tmp_path / subdir).mkdir(exist_ok=True)
+        (tmp_path / subdir / fname).write_bytes(b"x")
+
+    index = ArtifactIndex(str(tmp_path), ["noarch", "linux-64", "osx-64"])
+
+    assert sorted((r.subdir, r.name, r.version, r.build, r.ext) for r in index.records) == [
+        ("linux-64", "bar", "2.1", "h1234567_3", ".conda"),
+        ("noarch", "foo", "1.0", "py_0", ".conda"),
+        ("noarch", "foo", "1.0", "py_0", ".tar.bz2"),
+    ]
+    assert [r.name for r in index.select(names=["bar"])] == ["bar"]
+    out = capsys.readouterr().out
+    assert "notapackage.conda" in out
+    assert "bar-1.tar.bz2" in out
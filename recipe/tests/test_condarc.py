@@ -0,0 +1,115 @@
+import os
+import stat
+import subprocess
+import sys
+
+import pytest
+from click.testing import CliRunner
+
+from conda_forge_ci_setup.build_utils import cf_conda_build_defaults, setup_conda_rc
+from conda_forge_ci_setup.fs_utils import write_text_atomic
+
+INITIAL_CONDARCS = {
+    "missing": None,
+    "empty": "",
+    "defaults": "channels:\n  - defaults\n",
+    "existing": (
+        "# set by the image\n"
+        "channels:\n"
+        "  - bioconda\n"
+        "  - conda-forge\n"
+        "  - defaults\n"
+        "conda_build:\n"
+        "  pkg_format: '1'\n"
+        "always_yes: true\n"
+    ),
+}
+
+CONDA_FORGE_YML = "conda_build:\n  pkg_format: '2'\n  error_overlinking: true\n"
+
+CHANNEL_SOURCES = ["conda-forge/label/rc,conda-forge", "conda-forge"]
+
+
+def _make_prefix(root, initial):
+    prefix = root / "prefix"
+    (prefix / "conda-meta").mkdir(parents=True)
+    (prefix / "conda-meta" / "history").write_text("")
+    if initial is not None:
+        (prefix / ".condarc").write_text(initial)
+        os.chmod(prefix / ".condarc", 0o644)
+    return prefix
+
+
+def _conda_config_sequence(prefix, env):
+    """Edit the env .condarc with the `conda config` calls setup_conda_rc replaces."""
+    def conda_config(*args, check=True):
+        cmd = [sys.executable, "-m", "conda", "config", "--env"] + list(args)
+        if check:
+            subprocess.check_call(cmd, env=env)
+        else:
+            subprocess.call(cmd, env=env)
+
+    conda_build = dict(cf_conda_build_defaults)
+    conda_build.update({"pkg_format": "2", "error_overlinking": True})
+    for k, v in conda_build.items():
+        conda_config("--set", "conda_build.%s" % k, str(v))
+
+    conda_config("--remove", "channels", "defaults", check=False)
+
+    channels = []
+    for source in CHANNEL_SOURCES:
+        channels.extend(c.strip() for c in source.split(","))
+    for c in reversed(channels):
+        conda_config("--add", "channels", c)
+
+    conda_config("--set", "show_channel_urls", "true")
+
+
+@pytest.mark.parametrize("initial", sorted(INITIAL_CONDARCS))
+def test_setup_conda_rc_matches_conda_config(tmp_path, monkeypatch, initial):
+    pytest.importorskip("conda")
+
+    feedstock_root = tmp_path / "feedstock"
+    (feedstock_root / "recipe").mkdir(parents=True)
+    (feedstock_root / "conda-forge.yml").write_text(CONDA_FORGE_YML)
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(
+        "channel_sources:\n"
+        + "".join("- %s\n" % s for s in CHANNEL_SOURCES)
+        + "channel_targets:\n- conda-forge main\n"
+    )
+
+    expected_prefix = _make_prefix(tmp_path / "expected", INITIAL_CONDARCS[initial])
+    env = dict(os.environ, CONDA_PREFIX=str(expected_prefix))
+    _conda_config_sequence(expected_prefix, env)
+
+    actual_prefix = _make_prefix(tmp_path / "actual", INITIAL_CONDARCS[initial])
+    monkeypatch.setenv("CONDA_PREFIX", str(actual_prefix))
+    monkeypatch.delenv("CI", raising=False)
+    result = CliRunner().invoke(
+        setup_conda_rc,
+        [str(feedstock_root), str(feedstock_root / "recipe"), str(config_file)],
+    )
+    assert result.exit_code == 0, result.output
+
+    expected = expected_prefix / ".condarc"
+    actual = actual_prefix / ".condarc"
+    assert actual.read_text() == expected.read_text()
+    if sys.platform != "win32":
+        assert stat.S_IMODE(actual.stat().st_mode) == stat.S_IMODE(expected.stat().st_mode)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="POSIX file modes")
+def test_write_text_atomic_keeps_mode(tmp_path):
+    pth = tmp_path / "condarc"
+    pth.write_text("a: 1\n")
+    os.chmod(pth, 0o644)
+    write_text_atomic(str(pth), "a: 2\n")
+    assert pth.read_text() == "a: 2\n"
+    assert stat.S_IMODE(pth.stat().st_mode) == 0o644
+
+    umask = os.umask(0o022)
+    os.umask(umask)
+    new = tmp_path / "new"
+    write_text_atomic(str(new), "b: 1\n")
+    assert stat.S_IMODE(new.stat().st_mode) == 0o666 & ~umask
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from fake_servers import FakeValidationServer, make_artifact
+
+from conda_forge_ci_setup import feedstock_outputs
+from conda_forge_ci_setup.upload_journal import COPIED, UploadJournal
+from conda_forge_ci_setup.upload_or_check_non_existence import CopyPipeline
+
+
+@pytest.fixture
+def dists(tmp_path, monkeypatch):
+    monkeypatch.setenv("CONDA_FORGE_CI_SETUP_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("FEEDSTOCK_TOKEN", "test-token")
+    croot = str(tmp_path / "croot")
+    return [
+        make_artifact(croot, "noarch", "pkg%d" % i, "1.0", "0", payload_size=1024)
+        for i in range(6)
+    ]
+
+
+def _dist(path):
+    return "noarch/" + os.path.basename(path)
+
+
+def _run_pipeline(server, dists, monkeypatch, poll):
+    monkeypatch.setattr(feedstock_outputs, "VALIDATION_ENDPOINT", server.url)
+    monkeypatch.setattr(feedstock_outputs, "_poll_copied_on_prod", poll)
+    journal = UploadJournal(os.path.dirname(os.path.dirname(dists[0])), "cf-staging", "main")
+    pipeline = CopyPipeline("pkg", "main", journal, batch_size=2, git_sha="abc123")
+    for path in dists:
+        pipeline.add(path)
+    return pipeline.close(), journal
+
+
+def _not_copied(checksums, channel, num_polling_attempts, hash_type="sha256"):
+    return {dist: False for dist in checksums}
+
+
+def test_failed_batches_comment_once(dists, monkeypatch):
+    # the second and third batches fail, concurrently
+    failed = {dists[2], dists[3], dists[4], dists[5]}
+    with FakeValidationServer(latency=0.1) as server:
+        server.fail = {_dist(dists[2]), _dist(dists[4])}
+        results, journal = _run_pipeline(server, dists, monkeypatch, _not_copied)
+
+    assert results == {path: path not in failed for path in dists}
+    assert [journal.state(path) for path in dists] == [
+        None if path in failed else COPIED for path in dists
+    ]
+
+    assert sorted(len(req["outputs"]) for req in server.copy_requests) == [2, 2, 2]
+    assert all(req["git_sha"] == "abc123" for req in server.copy_requests)
+    failing = [req for req in server.copy_requests if server.fail & set(req["outputs"])]
+    assert len(failing) == 2
+    assert sum(req["comment_on_error"] for req in failing) <= 1
+
+
+def test_raising_batch_is_marked_failed(dists, monkeypatch):
+    def _poll(checksums, channel, num_polling_attempts, hash_type="sha256"):
+        raise RuntimeError("anaconda.org is down")
+
+    with FakeValidationServer() as server:
+        server.fail = {_dist(dists[0])}
+        results, journal = _run_pipeline(server, dists, monkeypatch, _poll)
+
+    assert results == {path: path not in dists[:2] for path in dists}
+    assert journal.state(dists[0]) is None
+    assert journal.state(dists[1]) is None
+    assert all(journal.state(path) == COPIED for path in dists[2:])
+    assert len(server.copy_requests) == 3
+    assert sum(req["comment_on_error"] for req in server.copy_requests) <= 1
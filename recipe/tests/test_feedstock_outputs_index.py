@@ -0,0 +1,178 @@
+import json
+import os
+import sqlite3
+import tarfile
+
+import pytest
+
+from fake_servers import FakeHTTPService
+
+from conda_forge_ci_setup import feedstock_outputs
+from conda_forge_ci_setup.feedstock_outputs_index import (
+    FeedstockOutputsIndex,
+    build_outputs_index,
+    compare_with_online,
+)
+
+RAW_URL = "https://raw.githubusercontent.com/conda-forge/feedstock-outputs/main"
+CONFIG = {"outputs_path": "outputs", "shard_level": 3, "shard_fill": "z"}
+OUTPUTS = {
+    "numpy": ["numpy"],
+    "libarrow": ["arrow-cpp", "arrow"],
+    "r-base": ["r-base"],
+    "py": ["py"],
+    "libllvm18": ["llvmdev"],
+}
+ALLOWLIST = """\
+llvmdev:
+  - libllvm*
+  - llvm-*
+ctng-compilers:
+  - "*_impl_linux-*"
+  - libgcc
+"""
+NAMES = [
+    "numpy", "NumPy", "libarrow", "r-base", "py",
+    "libllvm18", "libllvm19", "llvm-tools",
+    "gcc_impl_linux-64", "libgcc", "not-registered",
+]
+
+
+def _sharded_path(name):
+    chars = [c for c in name if c.isalnum()][:CONFIG["shard_level"]]
+    chars += [CONFIG["shard_fill"]] * (CONFIG["shard_level"] - len(chars))
+    return "%s/%s/%s.json" % (CONFIG["outputs_path"], "/".join(chars), name)
+
+
+def _write_snapshot(root):
+    files = {
+        "config.json": json.dumps(CONFIG),
+        "feedstock_outputs_autoreg_allowlist.yml": ALLOWLIST,
+        "README.md": "not indexed",
+    }
+    for name, feedstocks in OUTPUTS.items():
+        files[_sharded_path(name)] = json.dumps({"feedstocks": feedstocks})
+    for rel, text in files.items():
+        pth = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(pth), exist_ok=True)
+        with open(pth, "w") as fp:
+            fp.write(text)
+
+
+class FakeRawGitHub(FakeHTTPService):
+    """Serves a checkout of the feedstock-outputs repo like raw.githubusercontent.com."""
+
+    def __init__(self, root, latency=0.0):
+        super().__init__(latency=latency)
+        self.root = root
+
+    def handle(self, method, path, query, headers, body, chunked):
+        pth = os.path.join(self.root, *path.split("/")[4:])
+        if method != "GET" or not os.path.isfile(pth):
+            return 404, b"404: Not Found"
+        with open(pth, "rb") as fp:
+            return 200, fp.read()
+
+
+def _mapping(tmp_path):
+    pth = str(tmp_path / "mapping.json")
+    with open(pth, "w") as fp:
+        json.dump(OUTPUTS, fp)
+    return pth
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    root = str(tmp_path / "feedstock-outputs-main")
+    _write_snapshot(root)
+    return root
+
+
+@pytest.fixture(params=["checkout", "tarball"])
+def index(request, snapshot, tmp_path):
+    source = snapshot
+    if request.param == "tarball":
+        source = str(tmp_path / "main.tar.gz")
+        with tarfile.open(source, "w:gz") as tar:
+            tar.add(snapshot, arcname=os.path.basename(snapshot))
+    pth = str(tmp_path / "index.sqlite")
+    assert build_outputs_index(source, pth) == len(OUTPUTS)
+    index = FeedstockOutputsIndex(pth)
+    yield index
+    index.close()
+
+
+def test_index_lookups(index):
+    assert index.config == CONFIG
+    assert index.feedstocks("numpy") == ["numpy"]
+    # like the online lookup, the names are case-insensitive
+    assert index.feedstocks("NumPy") == ["numpy"]
+    assert index.feedstocks("libarrow") == ["arrow", "arrow-cpp"]
+    # the allowlist adds to the registered feedstocks ...
+    assert index.feedstocks("libllvm18") == ["llvmdev"]
+    # ... and allows outputs that are not registered
+    assert index.feedstocks("libllvm19") == ["llvmdev"]
+    assert index.feedstocks("gcc_impl_linux-64") == ["ctng-compilers"]
+    assert index.feedstocks("not-registered") is None
+
+
+def test_is_valid_feedstock_output_with_index(index):
+    dists = {
+        "linux-64/libllvm18-18.1.8-h0_0.conda": True,
+        # only allowed by the allowlist
+        "linux-64/libllvm19-19.1.0-h0_0.conda": True,
+        "linux-64/numpy-2.0.0-py312h0_0.conda": False,
+        # auto_register_all is not set in the config
+        "noarch/not-registered-1.0-pyh0_0.conda": False,
+    }
+    valid = feedstock_outputs.is_valid_feedstock_output(
+        "conda-forge/llvmdev-feedstock", list(dists), outputs_index=index,
+    )
+    assert valid == dists
+
+
+def test_index_without_allowlist_is_rejected(tmp_path):
+    pth = str(tmp_path / "old.sqlite")
+    build_outputs_index(_mapping(tmp_path), pth)
+    conn = sqlite3.connect(pth)
+    conn.execute("DELETE FROM meta WHERE key = 'allowlist'")
+    conn.commit()
+    conn.close()
+    with pytest.raises(RuntimeError, match="rebuild"):
+        FeedstockOutputsIndex(pth)
+
+
+def test_index_agrees_with_online_lookup(index, snapshot, monkeypatch):
+    pytest.importorskip("conda_forge_metadata")
+    requests = pytest.importorskip("requests")
+    from conda_forge_metadata import feedstock_outputs as cfm
+
+    with FakeRawGitHub(snapshot, latency=0.01) as server:
+        session = requests.Session()
+
+        def _get(url, **kwargs):
+            assert url.startswith(RAW_URL)
+            return session.get(server.url + url[len("https://raw.githubusercontent.com"):],
+                               **kwargs)
+
+        monkeypatch.setattr(cfm.requests, "get", _get)
+        caches = (
+            cfm._feedstock_outputs_config,
+            cfm._fetch_allowed_autoreg_feedstock_globs,
+            cfm._package_to_feedstock,
+        )
+        for func in caches:
+            func.cache_clear()
+        try:
+            index_time, online_time, mismatches = compare_with_online(index, NAMES)
+        finally:
+            # do not leave lookups from the fake server in the caches
+            for func in caches:
+                func.cache_clear()
+
+    print("looked up %d outputs: %.4fs with the index, %.3fs online" % (
+        len(NAMES), index_time, online_time))
+    assert mismatches == {}
+    assert any(p.startswith("/conda-forge/feedstock-outputs/main/outputs/")
+               for _, p in server.requests)
+    assert index_time < online_time
@@ -0,0 +1,174 @@
+import json
+import os
+
+import pytest
+
+from fake_servers import FakeHTTPService
+
+from conda_forge_ci_setup import ff_ci_pr_build
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "ff_ci_pr_build")
+REPO = "conda-forge/foo-feedstock"
+
+
+class FakeCIService(FakeHTTPService):
+    """Serves the fixture named by `route(path, query)`, with an ETag."""
+
+    def __init__(self, route):
+        super().__init__()
+        self.route = route
+        self.queries = []
+        self.conditional = []
+
+    def handle(self, method, path, query, headers, body, chunked):
+        with self.lock:
+            self.queries.append(query)
+        name = self.route(path, query)
+        if method != "GET" or name is None:
+            return 404, {}
+        etag = '"%s"' % name
+        if headers.get("If-None-Match") == etag:
+            with self.lock:
+                self.conditional.append(name)
+            return 304, None, {"ETag": etag}
+        with open(os.path.join(FIXTURES, name + ".json")) as fp:
+            return 200, json.load(fp), {"ETag": etag}
+
+
+@pytest.fixture(autouse=True)
+def _no_etags(monkeypatch):
+    monkeypatch.setattr(ff_ci_pr_build, "_ETAG_CACHE", {})
+
+
+@pytest.fixture
+def azure(monkeypatch):
+    def _route(path, query):
+        if path == "/conda-forge/feedstock builds/_apis/build/builds":
+            return "azure_builds"
+        return None
+
+    with FakeCIService(_route) as server:
+        monkeypatch.setenv("SYSTEM_COLLECTIONURI", server.url + "/conda-forge/")
+        monkeypatch.setenv("SYSTEM_TEAMPROJECT", "feedstock builds")
+        monkeypatch.setenv("SYSTEM_DEFINITIONID", "7")
+        yield server
+
+
+@pytest.mark.parametrize("build_num, latest", [(1203, True), (1190, False), (1150, False)])
+def test_azure(azure, build_num, latest):
+    assert ff_ci_pr_build.azure_check_latest_pr_build(REPO, 12, build_num) is latest
+
+    # one query of the builds of this pipeline for this PR, newest first
+    (query,) = azure.queries
+    assert query["definitions"] == "7"
+    assert query["branchName"] == "refs/pull/12/merge"
+    assert query["queryOrder"] == "queueTimeDescending"
+    assert query["$top"] == "10"
+
+
+def test_azure_not_a_pr(azure):
+    assert ff_ci_pr_build.azure_check_latest_pr_build(REPO, None, 1) is True
+    assert azure.queries == []
+
+
+@pytest.fixture
+def github(monkeypatch, tmp_path):
+    def _route(path, query):
+        if path == "/repos/%s/actions/runs" % REPO:
+            return "github_actions_runs_page%s" % query["page"]
+        return None
+
+    with FakeCIService(_route) as server:
+        monkeypatch.setenv("GITHUB_API_URL", server.url)
+        monkeypatch.setenv("GITHUB_WORKFLOW", "tests")
+        monkeypatch.delenv("GITHUB_EVENT_PATH", raising=False)
+        monkeypatch.delenv("GITHUB_HEAD_REF", raising=False)
+        monkeypatch.delenv("GITHUB_TOKEN", raising=False)
+        yield server
+
+
+def _pr_event(tmp_path, monkeypatch, head_repo, head_ref):
+    pth = str(tmp_path / "event.json")
+    with open(pth, "w") as fp:
+        json.dump({
+            "number": 12,
+            "pull_request": {
+                "head": {"ref": head_ref, "repo": {"full_name": head_repo}},
+            },
+        }, fp)
+    monkeypatch.setenv("GITHUB_EVENT_PATH", pth)
+
+
+def _check_github(build_num):
+    return ff_ci_pr_build.github_actions_check_latest_pr_build(
+        REPO, 12, build_num, page_size=3,
+    )
+
+
+@pytest.mark.parametrize(
+    "head_repo, build_num, latest, pages",
+    [
+        # a newer run from the same fork is on the second page
+        ("alice/foo-feedstock", 40, False, 2),
+        # the newest run of the fork, found on the second page
+        ("alice/foo-feedstock", 42, True, 2),
+        # the run of another fork with the same branch name is not this PR
+        ("bob/foo-feedstock", 43, True, 1),
+    ],
+)
+def test_github_actions_fork(
+    github, tmp_path, monkeypatch, head_repo, build_num, latest, pages
+):
+    _pr_event(tmp_path, monkeypatch, head_repo, "fix")
+
+    assert _check_github(build_num) is latest
+
+    assert [q["page"] for q in github.queries] == [str(p) for p in range(1, pages + 1)]
+    assert all(q["branch"] == "fix" for q in github.queries)
+    assert all(q["event"] == "pull_request" for q in github.queries)
+    assert all(q["per_page"] == "3" for q in github.queries)
+
+
+def test_github_actions_without_event(github):
+    # only the runs with pull request data are matched
+    assert _check_github(38) is False
+    assert _check_github(39) is True
+    assert _check_github(40) is True
+    assert all("branch" not in q for q in github.queries)
+
+
+def test_github_actions_last_page(github):
+    # no run of PR 14 is found, so the pages are read up to the last one
+    assert ff_ci_pr_build.github_actions_check_latest_pr_build(
+        REPO, 14, 30, page_size=3,
+    ) is True
+    assert [q["page"] for q in github.queries] == ["1", "2", "3"]
+
+
+def test_github_actions_conditional_requests(github, tmp_path, monkeypatch):
+    _pr_event(tmp_path, monkeypatch, "alice/foo-feedstock", "fix")
+
+    assert _check_github(42) is True
+    assert github.conditional == []
+    # the repeated check gets 304s and the same answer from the cached pages
+    assert _check_github(42) is True
+    assert github.conditional == [
+        "github_actions_runs_page1", "github_actions_runs_page2",
+    ]
+
+
+def test_base_url_parameter(github, monkeypatch):
+    monkeypatch.setenv("GITHUB_API_URL", "http://127.0.0.1:9")
+    assert ff_ci_pr_build.github_actions_check_latest_pr_build(
+        REPO, 12, 39, page_size=3, base_url=github.url + "/",
+    ) is True
+    assert len(github.queries) == 2
+
+
+def test_api_url_defaults(monkeypatch):
+    for env, _ in ff_ci_pr_build.API_URLS.values():
+        monkeypatch.delenv(env, raising=False)
+    assert ff_ci_pr_build.api_url("github_actions") == "https://api.github.com"
+    assert ff_ci_pr_build.api_url("circle") == "https://circleci.com/api/v1.1"
+    with pytest.raises(RuntimeError, match="SYSTEM_COLLECTIONURI"):
+        ff_ci_pr_build.api_url("azure")
@@ -0,0 +1,62 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+# the modules behind the console scripts
+ENTRY_POINT_MODULES = [
+    "conda_forge_ci_setup.ff_ci_pr_build",
+    "conda_forge_ci_setup.upload_or_check_non_existence",
+    "conda_forge_ci_setup.build_utils",
+    "conda_forge_ci_setup.mangle_homebrew",
+    "conda_forge_ci_setup.feedstock_outputs",
+    "conda_forge_ci_setup.inspect_artifacts",
+    "conda_forge_ci_setup.query_ci_config",
+    "conda_forge_ci_setup.conda_env_probe",
+    "conda_forge_ci_setup.feedstock_outputs_index",
+]
+
+# only imported by the code paths that need them
+HEAVY_MODULES = [
+    "conda",
+    "conda_build",
+    "binstar_client",
+    "requests",
+    "urllib3",
+    "joblib",
+    "rattler_build_conda_compat",
+    "conda_forge_metadata",
+    "conda_package_handling",
+    "zstandard",
+]
+
+# the startup budget of a console script module in ms
+IMPORT_TIME_BUDGET = 200
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+dt = 1000 * (time.perf_counter() - t0)
+heavy = sorted({{m.split(".")[0] for m in sys.modules}} & set({heavy!r}))
+print(json.dumps({{"ms": dt, "heavy": heavy}}))
+"""
+
+
+def _probe_import(module):
+    out = subprocess.check_output(
+        [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)]
+    )
+    return json.loads(out.decode("utf-8").strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("module", ENTRY_POINT_MODULES)
+def test_entry_point_import_is_light(module):
+    # best of a few runs so a busy CI machine does not make this flaky
+    results = [_probe_import(module) for _ in range(3)]
+    assert results[0]["heavy"] == [], "%s imports %s at startup" % (
+        module, ", ".join(results[0]["heavy"])
+    )
+    best = min(r["ms"] for r in results)
+    assert best < IMPORT_TIME_BUDGET, "%s took %.0f ms to import" % (module, best)
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+pytest.importorskip("binstar_client")
+
+from fake_servers import FakeAnacondaOrg, make_artifact  # noqa: E402
+
+from conda_forge_ci_setup import streaming_upload  # noqa: E402
+from conda_forge_ci_setup.upload_or_check_non_existence import upload  # noqa: E402
+
+PAYLOAD_SIZE = 8 * 1024 * 1024
+
+
+def test_stream_upload(tmp_path, monkeypatch):
+    pth = make_artifact(str(tmp_path), "linux-64", "big", "1.0", "h1234567_0", PAYLOAD_SIZE)
+    size = os.path.getsize(pth)
+
+    read_sizes = []
+    read = streaming_upload.MeteredFile.read
+
+    def _read(self, n=-1):
+        read_sizes.append(n)
+        return read(self, n)
+
+    monkeypatch.setattr(streaming_upload.MeteredFile, "read", _read)
+
+    with FakeAnacondaOrg() as server:
+        server.add_dist("cf-staging", "big", "1.0", "linux-64/other.tar.bz2")
+        metrics = streaming_upload.stream_upload(
+            server.client(), "cf-staging", "big", "1.0",
+            "linux-64/" + os.path.basename(pth), pth,
+            attrs={}, channels=["main"],
+        )
+
+    # the file was sent once, in bounded chunks, and checked by the server
+    (basename, body_size, _), = server.s3_bodies
+    assert basename == "linux-64/" + os.path.basename(pth)
+    assert body_size > size
+    assert server.commits == [("cf-staging", basename)]
+    assert server.dists[("cf-staging", "big", "1.0", basename)]["labels"] == ["main"]
+    assert read_sizes and all(0 < n <= 1024 * 1024 for n in read_sizes)
+
+    assert metrics.size == size
+    assert metrics.bytes_sent == size
+    assert metrics.time_to_first_read is not None
+    assert metrics.time_after_last_read is not None
+    assert metrics.bytes_per_second > 0
+    assert metrics.total_time >= metrics.time_to_first_read
+
+
+def test_upload_new_package(tmp_path, capsys):
+    pth = make_artifact(str(tmp_path), "noarch", "new-pkg", "2.0", "pyhd8ed1ab_0", 1024)
+
+    with FakeAnacondaOrg() as server:
+        upload(server.client(), pth, "cf-staging", "main")
+
+    basename = "noarch/" + os.path.basename(pth)
+    assert ("cf-staging", "new-pkg") in server.packages
+    assert ("cf-staging", "new-pkg", "2.0") in server.releases
+    assert server.commits == [("cf-staging", basename)]
+    assert "Uploaded %s:" % basename in capsys.readouterr().out
@@ -0,0 +1,103 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("binstar_client")
+
+from fake_servers import FakeAnacondaOrg, make_artifact  # noqa: E402
+
+from conda_forge_ci_setup import upload_or_check_non_existence as uoc  # noqa: E402
+from conda_forge_ci_setup.upload_journal import UploadJournal  # noqa: E402
+
+
+def _make_artifacts(croot, n, payload_size=64 * 1024):
+    for i in range(n):
+        make_artifact(
+            croot, "noarch", "pkg%d" % i, "1.0", "0", payload_size=payload_size + 4096 * i,
+        )
+    return uoc.list_built_distributions(
+        croot, ["noarch"], ["pkg%d" % i for i in range(n)]
+    )
+
+
+def _upload_to_staging(server, croot, dists, jobs):
+    cli = server.client()
+    uoc._configure_session(cli, jobs)
+    journal = UploadJournal(croot, "cf-staging", "main")
+    return uoc.upload_to_staging(
+        cli, dists, "cf-staging", "conda-forge", "main", journal, jobs=jobs,
+    )
+
+
+def test_list_built_distributions_largest_first(tmp_path):
+    croot = str(tmp_path)
+    for name, size in [("small", 10), ("large", 300000), ("medium", 30000)]:
+        make_artifact(croot, "noarch", name, "1.0", "0", payload_size=size)
+    make_artifact(croot, "noarch", "other", "1.0", "0", payload_size=500000)
+
+    dists = uoc.list_built_distributions(croot, ["noarch"], ["small", "medium", "large"])
+
+    assert [name for name, _, _ in dists] == ["large", "medium", "small"]
+    assert all(os.path.isfile(path) for _, _, path in dists)
+
+
+def test_concurrent_uploads_reduce_wall_time(tmp_path):
+    times = {}
+    for jobs in (1, 4):
+        croot = str(tmp_path / ("jobs%d" % jobs))
+        dists = _make_artifacts(croot, 8)
+        with FakeAnacondaOrg(latency=0.02) as server:
+            t0 = time.monotonic()
+            to_copy = _upload_to_staging(server, croot, dists, jobs)
+            times[jobs] = time.monotonic() - t0
+
+        assert sorted(to_copy) == sorted(path for _, _, path in dists)
+        assert sorted(b for _, b in server.commits) == sorted(
+            "noarch/" + os.path.basename(path) for _, _, path in dists
+        )
+        assert all(d["labels"] == ["main"] for d in server.dists.values())
+        if jobs == 1:
+            assert server.max_in_flight == 1
+            # the largest distributions are uploaded first
+            staged = [p.rsplit("/", 1)[-1] for _, p in server.requests if p.startswith("/stage/")]
+            assert staged == [os.path.basename(path) for _, _, path in dists]
+            assert dists[0][0] == "pkg7"
+        else:
+            assert 1 < server.max_in_flight <= jobs
+
+    print("upload of 8 distributions: %.2fs with 1 job, %.2fs with 4 jobs" % (
+        times[1], times[4]))
+    assert times[4] < 0.6 * times[1]
+
+
+def test_failed_upload_is_retried(tmp_path, monkeypatch):
+    croot = str(tmp_path)
+    dists = _make_artifacts(croot, 3)
+    flaky = "noarch/" + os.path.basename(dists[1][2])
+    sleeps = []
+    monkeypatch.setattr(uoc.time, "sleep", sleeps.append)
+
+    with FakeAnacondaOrg() as server:
+        server.s3_failures[flaky] = 1
+        to_copy = _upload_to_staging(server, croot, dists, jobs=2)
+
+    assert sorted(to_copy) == sorted(path for _, _, path in dists)
+    assert [b for b, _, _ in server.s3_bodies].count(flaky) == 2
+    assert sleeps == [5]
+
+
+def test_upload_fails_after_all_tries(tmp_path, monkeypatch):
+    croot = str(tmp_path)
+    dists = _make_artifacts(croot, 2)
+    broken = "noarch/" + os.path.basename(dists[0][2])
+    sleeps = []
+    monkeypatch.setattr(uoc.time, "sleep", sleeps.append)
+
+    with FakeAnacondaOrg() as server:
+        server.s3_failures[broken] = 10
+        with pytest.raises(Exception, match="Error uploading package"):
+            _upload_to_staging(server, croot, dists, jobs=2)
+
+    assert [b for b, _, _ in server.s3_bodies].count(broken) == 3
+    assert sleeps == [5, 10]